@@ -0,0 +1,220 @@
+import os
+import struct
+from typing import Optional
+
+# bytes at the beginning of an mp3 file that are searched for the first frame (after the ID3v2 tag)
+_MP3_SEARCH_SIZE = 64 * 1024
+
+_MP3_BITRATES = {
+    # (mpeg 1, layer): kbit/s by bitrate index
+    (True, 1): (0, 32, 64, 96, 128, 160, 192, 224, 256, 288, 320, 352, 384, 416, 448),
+    (True, 2): (0, 32, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320, 384),
+    (True, 3): (0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320),
+    (False, 1): (0, 32, 48, 56, 64, 80, 96, 112, 128, 144, 160, 176, 192, 224, 256),
+    (False, 2): (0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160),
+    (False, 3): (0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160)
+}
+
+_MP3_SAMPLE_RATES = {
+    3: (44100, 48000, 32000),  # mpeg 1
+    2: (22050, 24000, 16000),  # mpeg 2
+    0: (11025, 12000, 8000)  # mpeg 2.5
+}
+
+
+class _Mp3Frame:
+    """
+    The header of an mp3 frame
+    """
+
+    def __init__(self, header: bytes):
+        b1, b2, b3 = header[1], header[2], header[3]
+
+        if header[0] != 0xFF or b1 & 0xE0 != 0xE0:
+            raise ValueError("no frame sync")
+
+        version = (b1 >> 3) & 3
+        layer = 4 - ((b1 >> 1) & 3)
+        bitrate_index = b2 >> 4
+        sample_rate_index = (b2 >> 2) & 3
+
+        if version == 1 or layer == 4 or bitrate_index in (0, 15) or sample_rate_index == 3:
+            raise ValueError("invalid frame header")
+
+        self.mpeg1 = version == 3
+        self.layer = layer
+        self.bitrate = _MP3_BITRATES[(self.mpeg1, layer)][bitrate_index] * 1000
+        self.sample_rate = _MP3_SAMPLE_RATES[version][sample_rate_index]
+        self.mono = b3 >> 6 == 3
+
+        padding = (b2 >> 1) & 1
+        if layer == 1:
+            self.samples = 384
+            self.length = (12 * self.bitrate // self.sample_rate + padding) * 4
+        elif layer == 2 or self.mpeg1:
+            self.samples = 1152
+            self.length = 144 * self.bitrate // self.sample_rate + padding
+        else:
+            self.samples = 576
+            self.length = 72 * self.bitrate // self.sample_rate + padding
+
+    @property
+    def xing_offset(self) -> int:
+        # the side information before the Xing/Info header depends on the version and the channels
+        if self.mpeg1:
+            return 4 + (17 if self.mono else 32)
+        return 4 + (9 if self.mono else 17)
+
+
+def _skip_id3v2(file) -> int:
+    """
+    Returns the position after the ID3v2 tags at the beginning of the file
+    """
+
+    position = 0
+    while True:
+        file.seek(position)
+        header = file.read(10)
+        if len(header) < 10 or header[:3] != b"ID3":
+            return position
+
+        size = (header[6] & 0x7F) << 21 | (header[7] & 0x7F) << 14 | (header[8] & 0x7F) << 7 | (header[9] & 0x7F)
+        footer = 10 if header[5] & 0x10 else 0
+        position += 10 + size + footer
+
+
+def probe_mp3(path: str) -> Optional[float]:
+    """
+    Determines the duration of an mp3 file from its headers without decoding any frames
+
+    Uses the frame count of the Xing/Info or VBRI header if there is one, otherwise the file is assumed to have a
+    constant bitrate.
+
+    :param path: The path of the mp3 file
+    :return: The duration in seconds or None if no valid mp3 frame was found
+    """
+
+    file_size = os.path.getsize(path)
+
+    with open(path, "rb") as file:
+        start = _skip_id3v2(file)
+        file.seek(start)
+        data = file.read(_MP3_SEARCH_SIZE)
+
+        has_id3v1 = False
+        if file_size >= 128:
+            file.seek(file_size - 128)
+            has_id3v1 = file.read(3) == b"TAG"
+
+    position = data.find(b"\xFF")
+    while 0 <= position <= len(data) - 4:
+        try:
+            frame = _Mp3Frame(data[position:position + 4])
+        except ValueError:
+            position = data.find(b"\xFF", position + 1)
+            continue
+
+        # a random 0xFF in leftover tag data looks like a frame sync, the next frame has to follow directly
+        following = position + frame.length
+        if following + 4 <= len(data):
+            try:
+                _Mp3Frame(data[following:following + 4])
+            except ValueError:
+                position = data.find(b"\xFF", position + 1)
+                continue
+
+        xing = position + frame.xing_offset
+        if data[xing:xing + 4] in (b"Xing", b"Info"):
+            flags, = struct.unpack(">I", data[xing + 4:xing + 8])
+            if flags & 1:
+                frames, = struct.unpack(">I", data[xing + 8:xing + 12])
+                return frames * frame.samples / frame.sample_rate
+
+        vbri = position + 36
+        if data[vbri:vbri + 4] == b"VBRI":
+            frames, = struct.unpack(">I", data[vbri + 14:vbri + 18])
+            return frames * frame.samples / frame.sample_rate
+
+        audio_size = file_size - start - position - (128 if has_id3v1 else 0)
+        return audio_size * 8 / frame.bitrate
+
+    return None
+
+
+def _find_box(file, box_type: bytes, end: int) -> Optional[int]:
+    """
+    Searches the mp4 boxes from the current position until end and returns the position of the content of the box
+    """
+
+    while file.tell() + 8 <= end:
+        header = file.read(8)
+        size, current = struct.unpack(">I4s", header)
+        header_size = 8
+
+        if size == 1:
+            size, = struct.unpack(">Q", file.read(8))
+            header_size = 16
+        elif size == 0:
+            size = end - file.tell() + header_size
+
+        if size < header_size:
+            return None
+
+        if current == box_type:
+            return file.tell()
+
+        file.seek(size - header_size, os.SEEK_CUR)
+
+    return None
+
+
+def probe_mp4(path: str) -> Optional[float]:
+    """
+    Determines the duration of an mp4/m4a file from its movie header
+
+    :param path: The path of the file
+    :return: The duration in seconds or None if the file has no movie header
+    """
+
+    file_size = os.path.getsize(path)
+
+    with open(path, "rb") as file:
+        moov = _find_box(file, b"moov", file_size)
+        if moov is None:
+            return None
+
+        if _find_box(file, b"mvhd", file_size) is None:
+            return None
+
+        version = file.read(4)[0]
+        if version == 1:
+            timescale, duration = struct.unpack(">16xIQ", file.read(28))
+        else:
+            timescale, duration = struct.unpack(">8xII", file.read(16))
+
+    if not timescale:
+        return None
+    return duration / timescale
+
+
+def probe_duration(path: str) -> Optional[float]:
+    """
+    Determines the duration of an audio file by reading only its headers
+
+    Supports mp3 and mp4/m4a files, other formats (e.g. ogg) return None.
+
+    :param path: The path of the audio file
+    :return: The duration in seconds or None if it could not be determined
+    """
+
+    try:
+        with open(path, "rb") as file:
+            magic = file.read(12)
+
+        if magic[4:8] == b"ftyp":
+            return probe_mp4(path)
+        if magic[:4] == b"OggS" or magic[:4] == b"fLaC" or magic[:4] == b"RIFF":
+            return None
+        return probe_mp3(path)
+    except (OSError, struct.error, IndexError):
+        return None
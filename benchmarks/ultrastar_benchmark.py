@@ -0,0 +1,111 @@
+"""
+Measures how long reading the headers of UltraStar txt files takes.
+
+Usage: python benchmarks/ultrastar_benchmark.py [songs_directory]
+
+Compares the former approach (chardet on the whole file and a regex search per header) with ultrastar.read_headers.
+Pass a songs directory to measure real songs, otherwise a synthetic corpus with utf-8 and cp1252 files is generated.
+"""
+
+import os
+import re
+import sys
+import tempfile
+import time
+
+import chardet
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import ultrastar  # noqa: E402
+
+
+def read_headers_chardet(path: str) -> dict:
+    with open(path, "rb") as file:
+        encoding = chardet.detect(file.read())["encoding"]
+
+    with open(path, "r", encoding=encoding) as file:
+        txt = file.read()
+
+    headers = {}
+    for key in ("TITLE", "ARTIST", "COVER", "MP3"):
+        match = re.search(f"#{key}:(.*)\\n", txt)
+        if match:
+            headers[key] = match.group(1).strip()
+    return headers
+
+
+def create_corpus(directory: str, songs: int = 200):
+    for i in range(songs):
+        encoding = "cp1252" if i % 4 == 0 else "utf-8"
+        lines = [
+            f"#TITLE:Título número {i}",
+            f"#ARTIST:Künstler {i % 17}",
+            "#LANGUAGE:German",
+            "#EDITION:SingStar",
+            f"#MP3:Künstler {i % 17} - Título {i}.mp3",
+            f"#COVER:Künstler {i % 17} - Título {i} [CO].jpg",
+            "#BPM:300",
+            "#GAP:12000"
+        ]
+        beat = 0
+        for note in range(1500):
+            lines.append(f": {beat} 4 {note % 12} Wört{note} ")
+            beat += 6
+            if note % 8 == 7:
+                lines.append(f"- {beat}")
+        lines.append("E")
+
+        song_dir = os.path.join(directory, f"song {i}")
+        os.makedirs(song_dir)
+        with open(os.path.join(song_dir, "song.txt"), "w", encoding=encoding, newline="\r\n") as file:
+            file.write("\n".join(lines))
+
+
+def txt_files(directory: str):
+    for root, _, files in os.walk(directory):
+        for name in files:
+            if name.lower().endswith(".txt"):
+                yield os.path.join(root, name)
+
+
+def measure(name: str, read, paths) -> float:
+    start = time.perf_counter()
+    for path in paths:
+        read(path)
+    duration = time.perf_counter() - start
+    print(f"{name}: {duration * 1000:.1f} ms for {len(paths)} files ({duration * 1000000 / len(paths):.0f} µs per file)")
+    return duration
+
+
+def benchmark(directory: str):
+    paths = list(txt_files(directory))
+    if not paths:
+        print(f"No txt files in {directory}")
+        return
+
+    differences = 0
+    for path in paths:
+        old = read_headers_chardet(path)
+        new = ultrastar.read_headers(path)[0]
+        if any(new.get(key) != value for key, value in old.items()):
+            differences += 1
+    if differences:
+        print(f"{differences} files have different headers with ultrastar.read_headers")
+
+    old = measure("chardet + regex", read_headers_chardet, paths)
+    new = measure("ultrastar.read_headers", lambda path: ultrastar.read_headers(path), paths)
+    print(f"ultrastar.read_headers is {old / new:.1f}x faster")
+
+
+def main():
+    if len(sys.argv) > 1:
+        benchmark(sys.argv[1])
+    else:
+        with tempfile.TemporaryDirectory() as directory:
+            create_corpus(directory)
+            benchmark(directory)
+
+
+if __name__ == "__main__":
+    main()
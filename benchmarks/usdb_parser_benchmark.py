@@ -0,0 +1,93 @@
+"""
+Measures how long parsing a song list page of usdb.animux.de takes.
+
+Usage: python benchmarks/usdb_parser_benchmark.py [saved_page.html ...]
+
+Without arguments a synthetic page with the structure of the USDB song list (100 songs per page) is used. Pages
+saved from the browser ("?link=list") can be passed to measure real pages.
+"""
+
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import usdb_parser  # noqa: E402
+
+
+def synthetic_song_list(songs: int = 100, page: int = 1, pages: int = 20) -> str:
+    """
+    Builds a song list page like the ones usdb.animux.de returns
+
+    :param songs: The number of songs on the page
+    :param page: The current page
+    :param pages: The number of pages
+    :return: The html
+    """
+
+    rows = []
+    for i in range(songs):
+        stars = "<img src='images/star.png'>" * (i % 5) + ("<img src='images/half_star.png'>" if i % 2 else "")
+        rows.append(f"""
+            <tr class="list_tr{i % 2 + 1}">
+                <td onclick="show_detail({10000 + i})"><a href="?link=detail&id={10000 + i}">Artist {i}</a></td>
+                <td onclick="show_detail({10000 + i})"><a href="?link=detail&id={10000 + i}">Title {i}</a></td>
+                <td>Edition {i % 7}</td>
+                <td>{"Ja" if i % 3 == 0 else "Nein"}</td>
+                <td><img src='images/flags/de.gif'></td>
+                <td>{i % 4}</td>
+                <td>German</td>
+                <td>2023-01-01</td>
+                <td>{stars}</td>
+                <td>{i * 17}</td>
+            </tr>""")
+
+    links = "".join(f"<a href='#'><b><u>{p}</u></b></a> " if p == page else f"<a href='#'>[{p}]</a> " for p in range(1, pages + 1))
+
+    return f"""<html><head><title>USDB</title><script>function show_detail(id) {{}}</script></head><body>
+        <table><tr><td class="row3">{"<a href='#'>Menu</a>" * 30}</td></tr></table>
+        <table><tr><td class="row1">
+            <div>{links}</div>
+            <table>
+                <tr class="list_head"><td>Interpret</td><td>Titel</td><td>Edition</td><td>Goldene Noten</td><td></td>
+                <td>Songcheck</td><td>Sprache</td><td>Datum</td><td>Bewertung</td><td>Aufrufe</td></tr>
+                {"".join(rows)}
+            </table>
+            <div>{links}</div>
+        </td></tr></table>
+    </body></html>"""
+
+
+def benchmark(name: str, html: str, repeat: int = 20):
+    expected = usdb_parser.parse_song_list_bs4(html, 1)
+
+    results = {}
+    for parser in ("bs4", "lxml"):
+        parse = getattr(usdb_parser, f"parse_song_list_{parser}")
+        if parser == "lxml" and usdb_parser.lxml is None:
+            print(f"{name}: lxml is not installed")
+            continue
+
+        if parse(html, 1) != expected:
+            print(f"{name}: {parser} returned a different result than bs4")
+
+        results[parser] = min(timeit.repeat(lambda: parse(html, 1), number=1, repeat=repeat)) * 1000
+        print(f"{name}: {parser} {results[parser]:.2f} ms for {len(expected['songs'])} songs")
+
+    if len(results) == 2:
+        print(f"{name}: lxml is {results['bs4'] / results['lxml']:.1f}x faster")
+
+
+def main():
+    if len(sys.argv) > 1:
+        for file_name in sys.argv[1:]:
+            with open(file_name, encoding="utf-8", errors="replace") as file:
+                benchmark(os.path.basename(file_name), file.read())
+    else:
+        for songs in (30, 100):
+            benchmark(f"synthetic ({songs} songs)", synthetic_song_list(songs))
+
+
+if __name__ == "__main__":
+    main()
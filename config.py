@@ -49,6 +49,45 @@ else:
     youtube_dl = _config.get("OTHER", "youtube_dl")
     ffmpeg = _config.get("OTHER", "ffmpeg")
 
+scan_workers_local = _config.getint("PERFORMANCE", "scan_workers_local", fallback=8)
+scan_workers_network = _config.getint("PERFORMANCE", "scan_workers_network", fallback=2)
+duration_workers = _config.getint("PERFORMANCE", "duration_workers", fallback=2)
+watch_songs = _config.getboolean("PERFORMANCE", "watch_songs", fallback=True)
+network_poll_interval = _config.getfloat("PERFORMANCE", "network_poll_interval", fallback=30)
+song_index_file = Path(_config.get("PERFORMANCE", "song_index_file", fallback=os.path.join(os.path.dirname(os.path.abspath(file_name)), "song_index.sqlite"))).expanduser()
+download_workers = _config.getint("PERFORMANCE", "download_workers", fallback=8)
+download_network_limit = _config.getint("PERFORMANCE", "download_network_limit", fallback=4)
+download_youtube_limit = _config.getint("PERFORMANCE", "download_youtube_limit", fallback=2)
+download_ffmpeg_limit = _config.getint("PERFORMANCE", "download_ffmpeg_limit", fallback=os.cpu_count() or 1)
+job_store_file = Path(_config.get("PERFORMANCE", "job_store_file", fallback=os.path.join(os.path.dirname(os.path.abspath(file_name)), "download_jobs.sqlite"))).expanduser()
+usdb_max_connections = _config.getint("PERFORMANCE", "usdb_max_connections", fallback=8)
+usdb_timeout = _config.getfloat("PERFORMANCE", "usdb_timeout", fallback=20)
+usdb_retries = _config.getint("PERFORMANCE", "usdb_retries", fallback=3)
+usdb_cache_ttl = _config.getfloat("PERFORMANCE", "usdb_cache_ttl", fallback=300)
+usdb_cache_stale = _config.getfloat("PERFORMANCE", "usdb_cache_stale", fallback=3600)
+usdb_cache_size = _config.getint("PERFORMANCE", "usdb_cache_size", fallback=256)
+usdb_catalog_mode = _config.get("PERFORMANCE", "usdb_catalog_mode", fallback="off")
+usdb_catalog_file = Path(_config.get("PERFORMANCE", "usdb_catalog_file", fallback=os.path.join(os.path.dirname(os.path.abspath(file_name)), "usdb_catalog.sqlite"))).expanduser()
+usdb_catalog_sync_interval = _config.getfloat("PERFORMANCE", "usdb_catalog_sync_interval", fallback=3600)
+usdb_catalog_full_sync_interval = _config.getfloat("PERFORMANCE", "usdb_catalog_full_sync_interval", fallback=7 * 24 * 3600)
+audio_format = _config.get("PERFORMANCE", "audio_format", fallback="mp3")
+cache_dir = Path(_config.get("PERFORMANCE", "cache_dir", fallback=os.path.join(os.path.dirname(os.path.abspath(file_name)), "cache"))).expanduser()
+thumbnail_cache_dir = os.path.join(cache_dir, "thumbnails")
+usdb_proxy_cache_size = _config.getint("PERFORMANCE", "usdb_proxy_cache_size", fallback=500)
+usdb_proxy_cache_ttl = _config.getfloat("PERFORMANCE", "usdb_proxy_cache_ttl", fallback=24 * 3600)
+thumbnail_workers = _config.getint("PERFORMANCE", "thumbnail_workers", fallback=2)
+thumbnail_timeout = _config.getfloat("PERFORMANCE", "thumbnail_timeout", fallback=2)
+progress_interval = _config.getfloat("PERFORMANCE", "progress_interval", fallback=1)
+message_history = _config.getint("PERFORMANCE", "message_history", fallback=500)
+websocket_client_queue = _config.getint("PERFORMANCE", "websocket_client_queue", fallback=200)
+websocket_ping_interval = _config.getfloat("PERFORMANCE", "websocket_ping_interval", fallback=20)
+cover_max_age = _config.getint("PERFORMANCE", "cover_max_age", fallback=3600)
+http_server = _config.get("PERFORMANCE", "http_server", fallback="waitress")
+http_threads = _config.getint("PERFORMANCE", "http_threads", fallback=16)
+http_connection_limit = _config.getint("PERFORMANCE", "http_connection_limit", fallback=200)
+http_keep_alive = _config.getint("PERFORMANCE", "http_keep_alive", fallback=60)
+shutdown_timeout = _config.getfloat("PERFORMANCE", "shutdown_timeout", fallback=10)
+
 
 def save_usdb_credentials(username, password):
     _config['USDB'] = {'username': username, 'password': password}
@@ -0,0 +1,271 @@
+import email.utils
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+import time
+from concurrent.futures import Future
+from typing import Callable, Dict, Optional
+
+import httpx
+
+# headers of the upstream response that are stored and sent to the clients
+STORED_HEADERS = ("content-type", "content-disposition", "etag", "last-modified")
+
+# responses that may be reused, other responses (e.g. server errors) are only passed on
+_CACHEABLE_STATUS_CODES = {200, 404, 410}
+
+# errors are only kept for a short time, the resource might appear soon (e.g. the cover of a new song)
+_ERROR_TTL = 600
+
+_MAX_AGE_PATTERN = re.compile(r"(?:^|,)\s*(?:s-maxage|max-age)\s*=\s*\"?(\d+)")
+
+
+class CacheEntry:
+    """
+    A response stored in the cache
+    """
+
+    def __init__(self, meta: dict, path: Optional[str] = None, content: Optional[bytes] = None):
+        self.status_code: int = meta["status"]
+        self.headers: Dict[str, str] = meta["headers"]
+        self.expires: float = meta["expires"]
+        self.path = path
+        self.content = content
+
+    @property
+    def etag(self) -> Optional[str]:
+        etag = self.headers.get("etag")
+        if etag is None:
+            return None
+        if etag.startswith("W/"):
+            etag = etag[2:]
+        return etag.strip('"')
+
+    @property
+    def max_age(self) -> int:
+        return max(int(self.expires - time.time()), 0)
+
+
+def _freshness(status_code: int, headers, default_ttl: float) -> float:
+    """
+    Returns for how many seconds a response can be used without asking the server again
+    """
+
+    cache_control = headers.get("cache-control", "").lower()
+    if "no-store" in cache_control or "no-cache" in cache_control:
+        return 0
+
+    if status_code != 200:
+        return _ERROR_TTL
+
+    max_age = _MAX_AGE_PATTERN.search(cache_control)
+    if max_age is not None:
+        return int(max_age.group(1))
+
+    expires = headers.get("expires")
+    if expires is not None:
+        try:
+            return email.utils.parsedate_to_datetime(expires).timestamp() - time.time()
+        except (TypeError, ValueError):
+            return 0
+
+    return default_ttl
+
+
+class HttpCache:
+    """
+    Disk cache for responses of an upstream server (e.g. the covers of usdb.animux.de).
+
+    Responses are written to disk while they are downloaded and reused as long as they are fresh according to
+    Cache-Control and Expires (or a default time if the server does not say anything). Expired responses are
+    revalidated with their ETag or Last-Modified date. Clients asking for the same resource at the same time share one
+    upstream request.
+    """
+
+    def __init__(self, directory: str, open_stream: Callable, max_size: int, default_ttl: float):
+        """
+        :param directory: The directory for the cached responses
+        :param open_stream: Sends a request upstream, called with the method, url and headers, returns a response with
+            status_code, headers, iter_bytes() and close() (see usdb.open_stream)
+        :param max_size: The maximum size of the cache in bytes, the least recently used responses are removed first
+        :param default_ttl: Seconds to reuse responses that do not say how long they can be cached
+        """
+
+        self.directory = directory
+        self.open_stream = open_stream
+        self.max_size = max_size
+        self.default_ttl = default_ttl
+
+        self._lock = threading.Lock()
+        self._pending: Dict[str, Future] = {}
+        self._written = 0
+
+        os.makedirs(directory, exist_ok=True)
+
+    def _paths(self, key: str):
+        base = os.path.join(self.directory, key[:2], key)
+        return f"{base}.json", f"{base}.body"
+
+    def _load(self, key: str) -> Optional[CacheEntry]:
+        meta_path, body_path = self._paths(key)
+        try:
+            with open(meta_path, "r", encoding="utf-8") as file:
+                meta = json.load(file)
+        except (OSError, ValueError):
+            return None
+
+        if not os.path.isfile(body_path):
+            return None
+
+        return CacheEntry(meta, path=body_path)
+
+    def _store_meta(self, key: str, meta: dict):
+        meta_path, _ = self._paths(key)
+        temp = f"{meta_path}.{threading.get_ident()}.tmp"
+        with open(temp, "w", encoding="utf-8") as file:
+            json.dump(meta, file)
+        os.replace(temp, meta_path)
+
+    def get(self, url: str, headers: Optional[dict] = None) -> CacheEntry:
+        """
+        Returns the response for a GET request, from the cache if possible
+
+        :param url: The url of the resource
+        :param headers: Headers for the upstream request (if it is needed)
+        :return: The response, its body is either a file (path) or, for responses that are not cached, in memory
+            (content)
+        """
+
+        key = hashlib.sha1(url.encode("utf-8")).hexdigest()
+
+        entry = self._load(key)
+        if entry is not None and entry.expires > time.time():
+            # remember the use for the removal of the least recently used responses
+            try:
+                os.utime(entry.path)
+            except OSError:
+                pass
+            return entry
+
+        with self._lock:
+            future = self._pending.get(key)
+            created = future is None
+            if created:
+                future = self._pending[key] = Future()
+
+        if not created:
+            return future.result()
+
+        try:
+            entry = self._fetch(key, url, headers or {}, entry)
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                del self._pending[key]
+
+        future.set_result(entry)
+        return entry
+
+    def _fetch(self, key: str, url: str, headers: dict, stale: Optional[CacheEntry]) -> CacheEntry:
+        headers = dict(headers)
+        if stale is not None:
+            if "etag" in stale.headers:
+                headers["If-None-Match"] = stale.headers["etag"]
+            if "last-modified" in stale.headers:
+                headers["If-Modified-Since"] = stale.headers["last-modified"]
+
+        try:
+            response = self.open_stream("GET", url, headers=headers)
+        except httpx.HTTPError as e:
+            if stale is None:
+                raise
+            logging.warning(f"Could not revalidate {url}, using the cached response: {e}")
+            return stale
+
+        meta_path, body_path = self._paths(key)
+
+        if response.status_code == 304 and stale is not None:
+            response.close()
+
+            meta = {
+                "status": stale.status_code,
+                "headers": {**stale.headers, **{name: response.headers[name] for name in STORED_HEADERS if name in response.headers}},
+                "expires": time.time() + _freshness(stale.status_code, response.headers, self.default_ttl)
+            }
+            self._store_meta(key, meta)
+
+            return CacheEntry(meta, path=body_path)
+
+        meta = {
+            "status": response.status_code,
+            "headers": {name: response.headers[name] for name in STORED_HEADERS if name in response.headers},
+            "expires": time.time() + _freshness(response.status_code, response.headers, self.default_ttl)
+        }
+
+        if response.status_code not in _CACHEABLE_STATUS_CODES:
+            return CacheEntry(meta, content=b"".join(response.iter_bytes()))
+
+        # the body goes straight to disk, it is never held in memory completely
+        os.makedirs(os.path.dirname(body_path), exist_ok=True)
+        temp = f"{body_path}.{threading.get_ident()}.tmp"
+        size = 0
+        try:
+            with open(temp, "wb") as file:
+                for chunk in response.iter_bytes():
+                    file.write(chunk)
+                    size += len(chunk)
+            os.replace(temp, body_path)
+        finally:
+            if os.path.exists(temp):
+                os.remove(temp)
+
+        self._store_meta(key, meta)
+        self._written += size
+
+        # pruning needs a walk over the whole cache, so it only happens after a few MB were written
+        if self._written > self.max_size / 20:
+            self._written = 0
+            threading.Thread(target=self.prune, name="http-cache-prune", daemon=True).start()
+
+        return CacheEntry(meta, path=body_path)
+
+    def prune(self):
+        """
+        Removes the least recently used responses until the cache is smaller than max_size
+        """
+
+        bodies = []
+        total = 0
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                if name.endswith(".body"):
+                    path = os.path.join(root, name)
+                    try:
+                        stat = os.stat(path)
+                    except OSError:
+                        continue
+                    bodies.append((stat.st_mtime, stat.st_size, path))
+                    total += stat.st_size
+
+        if total <= self.max_size:
+            return
+
+        removed = 0
+        for _, size, path in sorted(bodies):
+            if total <= self.max_size:
+                break
+
+            for file_name in (path, path[:-len(".body")] + ".json"):
+                try:
+                    os.remove(file_name)
+                except OSError:
+                    pass
+            total -= size
+            removed += 1
+
+        logging.info(f"Removed {removed} responses from the cache in {self.directory}")
@@ -0,0 +1,97 @@
+import sqlite3
+import threading
+import time
+from typing import List
+
+
+class JobStore:
+    """
+    Persistent store of the download jobs
+
+    Every queued download is recorded with its state and the pipeline stage it reached, so unfinished downloads can be
+    continued after a restart. Finished jobs are removed, failed jobs are kept until they are queued again.
+    """
+
+    def __init__(self, file_name: str):
+        """
+        Opens (and if needed creates) the job store
+
+        :param file_name: The path to the sqlite database
+        """
+
+        self.file_name = file_name
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(file_name, check_same_thread=False)
+        self._connection.execute("""
+            CREATE TABLE IF NOT EXISTS jobs (
+                usdb_id INTEGER PRIMARY KEY,
+                state TEXT NOT NULL,
+                stage TEXT,
+                error TEXT,
+                created REAL NOT NULL,
+                updated REAL NOT NULL
+            )
+        """)
+        self._connection.commit()
+
+    def _execute(self, sql: str, parameters: tuple = ()):
+        with self._lock:
+            with self._connection:
+                return self._connection.execute(sql, parameters).fetchall()
+
+    def add(self, usdb_id: int) -> bool:
+        """
+        Records a new queued job, a failed job with the same id is queued again.
+
+        Jobs are unique per song, so adding a song that is already queued or being downloaded does nothing.
+
+        :param usdb_id: The usdb id of the song
+        :return: True if the job was added, False if there already is a queued or running job for the song
+        """
+
+        now = time.time()
+        with self._lock:
+            with self._connection:
+                cursor = self._connection.execute("""
+                    INSERT INTO jobs (usdb_id, state, stage, error, created, updated) VALUES (?, 'queued', NULL, NULL, ?, ?)
+                    ON CONFLICT (usdb_id) DO UPDATE SET state = 'queued', error = NULL, updated = excluded.updated WHERE state = 'failed'
+                """, (usdb_id, now, now))
+                return cursor.rowcount > 0
+
+    def set_stage(self, usdb_id: int, stage: str):
+        """
+        Records that a job entered a stage of the download pipeline
+
+        :param usdb_id: The usdb id of the song
+        :param stage: The name of the stage
+        """
+
+        self._execute("UPDATE jobs SET state = 'running', stage = ?, updated = ? WHERE usdb_id = ?", (stage, time.time(), usdb_id))
+
+    def finish(self, usdb_id: int):
+        """
+        Removes a successfully finished job
+
+        :param usdb_id: The usdb id of the song
+        """
+
+        self._execute("DELETE FROM jobs WHERE usdb_id = ?", (usdb_id,))
+
+    def fail(self, usdb_id: int, error: str):
+        """
+        Marks a job as failed
+
+        :param usdb_id: The usdb id of the song
+        :param error: The error message
+        """
+
+        self._execute("UPDATE jobs SET state = 'failed', error = ?, updated = ? WHERE usdb_id = ?", (error, time.time(), usdb_id))
+
+    def unfinished(self) -> List[int]:
+        """
+        Returns the ids of all jobs that were queued or running, oldest first
+
+        :return: The usdb ids
+        """
+
+        return [row[0] for row in self._execute("SELECT usdb_id FROM jobs WHERE state IN ('queued', 'running') ORDER BY created")]
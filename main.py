@@ -1,10 +1,13 @@
 import getpass
 import os
 import asyncio
+import base64
+import concurrent.futures
 import json
 import logging
 import os.path
 import platform
+import re
 import signal
 import subprocess
 import threading
@@ -13,21 +16,34 @@ from tkinter import ttk
 from PIL import Image, ImageTk, ImageDraw, ImageFont
 import qrcode
 import socket
+from typing import Optional
 
+import httpx
 import websockets
-from flask import render_template, Flask, request, send_file
+from flask import render_template, Flask, request, send_file, Response
 
 import config
+import http_cache
+import payloads
+import thumbnails
+from job_store import JobStore
 import usdb
+from usdb_catalog import UsdbCatalog
 import usdx
 from song import Song
-from websocket_server import WebSocketServer, messages
+from song_watcher import SongWatcher
+from web_server import WebServer
+from websocket_server import WebSocketServer
 
 SCRIPT_BASE_PATH = os.path.abspath(os.path.dirname(__file__))
 
 app = Flask(__name__, static_folder=os.path.join(SCRIPT_BASE_PATH, "static"), template_folder=os.path.join(SCRIPT_BASE_PATH, "templates"))
 usdx_process = None
 download_queue = asyncio.Queue()
+job_store = JobStore(config.job_store_file)
+websocket_server = WebSocketServer(download_queue, job_store)
+prefetch_executor = concurrent.futures.ThreadPoolExecutor(max_workers=2, thread_name_prefix="prefetch")
+usdb_catalog = UsdbCatalog(config.usdb_catalog_file) if config.usdb_catalog_mode != "off" else None
 event_loop = asyncio.get_event_loop()
 php_session_id = None
 
@@ -49,24 +65,62 @@ def restart_usdx():
 
 @app.route('/')
 def index():
-    return render_template('index.html', messages=messages)
+    return render_template('index.html')
 
 
 @app.route('/songs')
 def songs():
-    return render_template('songs.html', songs=Song.song_list(), messages=messages)
+    return render_template('songs.html')
+
+
+def send_cover(path: str, name: str, mimetype: str, download_name: Optional[str] = None):
+    """
+    Sends a cover, or a thumbnail of it if the request asks for a size
+
+    If the thumbnail is not ready in time or can not be created, the original cover is sent.
+
+    :param path: The path of the cover
+    :param name: Describes the cover in the log
+    :param mimetype: The mimetype of the original cover
+    :param download_name: Optional file name of the original cover
+    :return: The flask response
+    """
+
+    size = request.args.get("size", type=int)
+    if size is not None:
+        size = thumbnails.fit_size(size)
+        # only if it is listed, browsers that can not show webp also send image/* or */*
+        fmt = "webp" if any(mimetype == "image/webp" and quality > 0 for mimetype, quality in request.accept_mimetypes) else "jpeg"
+
+        try:
+            thumbnail, digest = thumbnails.get_thumbnail(path, size, fmt).result(timeout=config.thumbnail_timeout)
+        except concurrent.futures.TimeoutError:
+            logging.info(f"Thumbnail for {name} is not ready yet, sending the original cover")
+        except FileNotFoundError:
+            return "", 404
+        except Exception as e:
+            logging.warning(f"Could not create thumbnail for {name}, sending the original cover: {e}")
+        else:
+            response = send_file(thumbnail, mimetype=thumbnails.FORMATS[fmt], etag=thumbnails.etag(digest, size, fmt), conditional=True, max_age=config.cover_max_age)
+            response.vary.add("Accept")
+            return response
+
+    try:
+        return send_file(path, mimetype=mimetype, download_name=download_name, conditional=True, max_age=config.cover_max_age)
+    except FileNotFoundError:
+        return "", 404
 
 
 @app.route('/song/<song_id>/cover', methods=['GET'])
 def cover(song_id):
     song = Song.get_song_by_id(song_id)
 
-    if song.cover_path:
-        return send_file(song.cover_path, mimetype=f'image/{song.cover_path.rsplit(".", 1)[-1].lower()}')
-    else:
+    if song is None or not song.cover_path:
         # TODO: default cover
         return "", 404
 
+    return send_cover(song.cover_path, str(song), f'image/{song.cover_path.rsplit(".", 1)[-1].lower()}')
+
 
 @app.route('/avatars/<avatar>', methods=['GET'])
 def avatar(avatar):
@@ -79,19 +133,19 @@ def avatar(avatar):
 @app.route('/download')
 def download():
     if request.args.get("view", "list") == "usdb":
-        return render_template('download.html', messages=messages)
+        return render_template('download.html')
     else:
-        return render_template('download_list.html', messages=messages)
+        return render_template('download_list.html')
 
 
 @app.route('/scores')
 def scores():
-    return render_template('scores.html', messages=messages)
+    return render_template('scores.html')
 
 
 @app.route('/players')
 def players():
-    return render_template('players.html', messages=messages, colors=config.setup_colors)
+    return render_template('players.html', colors=config.setup_colors)
 
 
 @app.route('/api/restart', methods=['POST'])
@@ -100,9 +154,63 @@ def api_restart():
     return {"success": True}, 200
 
 
+@app.route('/api/songs', methods=['GET'])
+def api_songs():
+    sort = request.args.get("sort", "title")
+    if sort not in ("title", "artist"):
+        return {"success": False, "error": f"invalid sort '{sort}'"}, 400
+
+    cursor = request.args.get("cursor")
+    if cursor:
+        try:
+            cursor = json.loads(base64.urlsafe_b64decode(cursor))
+        except (ValueError, TypeError):
+            return {"success": False, "error": "invalid cursor"}, 400
+
+        # the sort key of a song (see Song.sorted_songs)
+        if not isinstance(cursor, list) or len(cursor) != 3 or not all(isinstance(value, str) for value in cursor):
+            return {"success": False, "error": "invalid cursor"}, 400
+        cursor = tuple(cursor)
+
+    descending = request.args.get("order", "asc") == "desc"
+    limit = min(max(request.args.get("limit", 50, type=int), 1), 200)
+    query = request.args.get("q", "").strip() or None
+    scanning = Song.get_scan_progress()["running"]
+
+    def build():
+        songs, next_cursor, total = Song.page(sort=sort, descending=descending, cursor=cursor or None, limit=limit, query=query)
+
+        return {
+            "fields": Song.ROW_FIELDS,
+            "songs": [song.to_row() for song in songs],
+            "next": base64.urlsafe_b64encode(json.dumps(next_cursor).encode()).decode() if next_cursor is not None else None,
+            "total": total,
+            "scanning": scanning
+        }
+
+    # every phone opening the song list asks for the same first pages
+    key = ("songs", sort, descending, cursor or None, limit, query)
+    return payloads.get(key, (Song.version, scanning), build).response(request)
+
+
+@app.route('/api/songs/search', methods=['GET'])
+def api_songs_search():
+    songs = Song.search(request.args.get("q", ""), limit=min(max(request.args.get("limit", 50, type=int), 1), 200))
+
+    return {
+        "fields": Song.ROW_FIELDS,
+        "songs": [song.to_row() for song in songs]
+    }, 200
+
+
+@app.route('/api/songs/scan', methods=['GET'])
+def api_songs_scan():
+    return Song.get_scan_progress(), 200
+
+
 @app.route('/api/usdb_ids', methods=['GET'])
 def api_ausdb_ids():
-    return list(Song.usdb_ids), 200
+    return payloads.get("usdb_ids", Song.version, Song.sorted_usdb_ids).response(request)
 
 
 @app.route('/api/download', methods=['POST'])
@@ -112,51 +220,102 @@ def api_download_post():
         return {"success": False, "error": "missing id"}, 400
     id = int(id)
 
-    asyncio.run_coroutine_threadsafe(download_queue.put(id), event_loop)
+    if id in Song.by_usdb_id:
+        return {"success": False, "error": f"song {id} is already downloaded"}, 409
 
-    return {"success": True}, 200
+    # requests for songs that are already queued join the existing job, all clients get its result over the websocket
+    if not job_store.add(id):
+        return {"success": True, "queued": False}, 200
+
+    asyncio.run_coroutine_threadsafe(websocket_server.enqueue_download(id), event_loop)
+
+    return {"success": True, "queued": True}, 200
+
+
+# request headers of the clients that are passed on to usdb.animux.de
+PROXY_REQUEST_HEADERS = ("accept", "accept-language", "content-type", "user-agent")
+# response headers of usdb.animux.de that are passed on to the clients
+PROXY_RESPONSE_HEADERS = http_cache.STORED_HEADERS + ("cache-control", "expires")
+# static resources like covers, images, stylesheets and scripts are the same for everybody and can be cached
+PROXY_CACHEABLE_PATH = re.compile(r"^data/|\.(jpe?g|png|gif|webp|ico|svg|css|js|woff2?|ttf)$", re.IGNORECASE)
+
+
+@app.route('/api/usdb/cover/<int:usdb_id>', methods=['GET'])
+def usdb_cover(usdb_id):
+    try:
+        path = usdb.get_cover(usdb_id)
+    except httpx.HTTPError as e:
+        logging.warning(f"Could not fetch the cover of {usdb_id}: {e}")
+        return "", 502
+
+    if path is None:
+        return "", 404
+
+    return send_cover(path, f"the cover of {usdb_id}", "image/jpeg", download_name=f"{usdb_id}.jpg")
 
 
 @app.route('/usdb/', defaults={'path': ''}, methods=['GET', 'POST', 'PUT', 'DELETE'])
 @app.route('/usdb/<path:path>', methods=['GET', 'POST', 'PUT', 'DELETE'])
 def proxy(path):
-    # TODO: data does not work correctly
-    res = usdb.session.request(
-        method=request.method,
-        url=request.url.replace(f"{request.host_url}usdb/", "https://usdb.animux.de/"),
-        data=request.get_data(),
-    )
+    url = request.url.replace(f"{request.host_url}usdb/", "https://usdb.animux.de/")
+    headers = {name: value for name, value in request.headers.items() if name.lower() in PROXY_REQUEST_HEADERS}
+
+    try:
+        if request.method == "GET" and PROXY_CACHEABLE_PATH.search(path):
+            entry = usdb.cache.get(url, headers)
+
+            if entry.content is not None:
+                return entry.content, entry.status_code, entry.headers
+
+            response = send_file(
+                entry.path,
+                mimetype=entry.headers.get("content-type", "application/octet-stream"),
+                download_name=path.rsplit("/", 1)[-1],
+                etag=entry.etag or False,
+                conditional=True,
+                max_age=entry.max_age
+            )
+            if entry.status_code != 200:
+                response.status_code = entry.status_code
+            return response
+
+        res = usdb.open_stream(request.method, url, headers=headers, content=request.get_data())
+    except httpx.HTTPError as e:
+        logging.warning(f"Could not proxy {url}: {e}")
+        return "", 502
+
+    # the body is passed on while it is downloaded instead of being read into memory first
+    return Response(res.iter_bytes(), res.status_code, [(name, value) for name, value in res.headers.items() if name.lower() in PROXY_RESPONSE_HEADERS])
+
+
+def search_usdb(args: dict) -> dict:
+    # genre and songcheck are not part of the catalog, these searches always need usdb.animux.de
+    catalog_args = {key: value for key, value in args.items() if key not in ("genre", "songcheck")}
+    catalog = usdb_catalog if usdb_catalog is not None and not args.get("genre") and not args.get("songcheck") else None
+
+    if catalog is not None and config.usdb_catalog_mode == "mirror" and catalog.complete:
+        songs = catalog.get_songs(**catalog_args)
+    else:
+        try:
+            songs = usdb.get_songs(**args)
+        except httpx.HTTPError as e:
+            if catalog is None or not catalog.count():
+                raise
+
+            logging.warning(f"Searching the USDB catalog since usdb.animux.de is not available: {e}")
+            songs = catalog.get_songs(**catalog_args)
+
+    return songs
+
+
+def prefetch_next_page(args: dict):
+    try:
+        songs = search_usdb(args)
+    except Exception as e:
+        logging.debug(f"Could not prefetch page {args['page']} of the USDB search: {e}")
+        return
 
-    return res.content, res.status_code
-
-    # headers = {k: v for k, v in request.headers if k.lower() != 'host'}
-    #
-    # # let everybody use the same php session key
-    # global php_session_id
-    # if php_session_id is None:
-    #     php_session_id = headers.get("Cookie")
-    #     Song.php_session_id = php_session_id
-    #
-    # if php_session_id is not None:
-    #     headers["Cookie"] = php_session_id
-    #
-    # res = requests.request(
-    #     method=request.method,
-    #     url=request.url.replace(f"{request.host_url}usdb/", "https://usdb.animux.de/"),
-    #     headers=headers,
-    #     data=request.get_data(),
-    #     cookies=request.cookies,
-    #     allow_redirects=False,
-    # )
-    #
-    # excluded_headers = ['content-encoding', 'content-length', 'transfer-encoding', 'connection']
-    # headers = [
-    #     (k, v) for k, v in res.raw.headers.items()
-    #     if k.lower() not in excluded_headers
-    # ]
-    #
-    # response = Response(res.content, res.status_code, headers)
-    # return response
+    usdb.prefetch_covers(song["id"] for song in songs["songs"])
 
 
 @app.route('/api/usdb/get_songs', methods=['GET'])
@@ -166,12 +325,18 @@ def get_songs_route():
         if key in args:
             args[key] = args[key] == "true"
 
-    songs = usdb.get_songs(**args)
+    songs = search_usdb(args)
 
-    for song in songs["songs"]:
-        song["downloaded"] = song["id"] in Song.usdb_ids
+    # the covers of this and the next page are most likely requested soon
+    usdb.prefetch_covers(song["id"] for song in songs["songs"])
+    if songs["paging"]["current"] < songs["paging"]["pages"]:
+        prefetch_executor.submit(prefetch_next_page, {**args, "page": songs["paging"]["current"] + 1})
 
-    return songs
+    # the result is cached, so the songs are copied instead of modified
+    return {
+        **songs,
+        "songs": [{**song, "downloaded": song["id"] in Song.by_usdb_id} for song in songs["songs"]]
+    }
 
 
 @app.route('/api/players', methods=['GET', 'POST'])
@@ -181,6 +346,7 @@ def names():
         logging.info(f"Adding player '{name}'")
         with open(config.players_file, 'a') as file:
             file.write(name + '\n')
+        asyncio.run_coroutine_threadsafe(websocket_server.send_players_change("added", name), event_loop)
         return {"success": True}
     else:
         try:
@@ -201,6 +367,7 @@ def delete_name():
         for name in names:
             if name != name_to_delete:
                 file.write(name + '\n')
+    asyncio.run_coroutine_threadsafe(websocket_server.send_players_change("removed", name_to_delete), event_loop)
     return {"success": True}
 
 
@@ -308,29 +475,79 @@ def main():
     usdx.change_config(config.setup_colors)
     restart_usdx()
 
-    # Start Flask server in a thread
-    server_thread = threading.Thread(target=app.run, kwargs={"host": "0.0.0.0", "port": 8080})
-    server_thread.daemon = True
-    server_thread.start()
-
-    # Wait a moment for the server to start
-    import time
-    time.sleep(1)
+    web_server = WebServer(app, "0.0.0.0", 8080)
+    web_server.start()
 
     # Show access info
     show_access_info()
 
-    Song.load_songs()
-    server = WebSocketServer(download_queue)
+    # continue the downloads that were not finished before the last shutdown
+    unfinished = job_store.unfinished()
+    Song.clean_staging(unfinished)
+    for id in unfinished:
+        download_queue.put_nowait(id)
+    if unfinished:
+        logging.info(f"Continuing {len(unfinished)} unfinished downloads")
+
+    if usdb_catalog is not None:
+        threading.Thread(
+            target=usdb_catalog.sync_forever,
+            args=(config.usdb_catalog_sync_interval, config.usdb_catalog_full_sync_interval),
+            name="usdb-catalog",
+            daemon=True
+        ).start()
+
+    def watch_songs():
+        watcher = SongWatcher(
+            lambda action, song: asyncio.run_coroutine_threadsafe(websocket_server.send_library_change(action, song), event_loop),
+            poll_interval=config.network_poll_interval
+        )
+        watcher.add_root(config.usdx_songs_dir, "local")
+        watcher.add_root(config.network_songs_dir, "net", native=False)
+        watcher.start()
+
+    Song.load_songs_in_background(on_finished=watch_songs if config.watch_songs else None)
+
+    start_server = websockets.serve(websocket_server.handler, "0.0.0.0", 5678, ping_interval=config.websocket_ping_interval, ping_timeout=config.websocket_ping_interval)
+
+    ws_server = event_loop.run_until_complete(start_server)
+
+    consumers = [event_loop.create_task(websocket_server.download_queue_consumer(i)) for i in range(config.download_workers)]
+
+    def stop(signum, frame):
+        event_loop.call_soon_threadsafe(event_loop.stop)
 
-    start_server = websockets.serve(server.handler, "0.0.0.0", 5678)
+    signal.signal(signal.SIGINT, stop)
+    signal.signal(signal.SIGTERM, stop)
 
-    asyncio.get_event_loop().run_until_complete(start_server)
+    event_loop.run_forever()
 
-    for i in range(8):
-        asyncio.get_event_loop().create_task(server.download_queue_consumer(i))
+    shutdown(web_server, ws_server, consumers)
+
+
+def shutdown(web_server: WebServer, ws_server, consumers: list):
+    """
+    Stops the servers and the downloads after the event loop was stopped (e.g. with Ctrl+C)
+
+    Requests and websocket connections get config.shutdown_timeout seconds to finish. Aborted downloads stay in the
+    job store and are continued on the next start.
+    """
+
+    logging.info("Shutting down")
+
+    web_server.stop(config.shutdown_timeout)
+
+    for consumer in consumers:
+        consumer.cancel()
+
+    # the phones get a 'going away' close frame and reconnect once the server is back
+    ws_server.close()
+    try:
+        event_loop.run_until_complete(asyncio.wait_for(ws_server.wait_closed(), config.shutdown_timeout))
+    except asyncio.TimeoutError:
+        logging.warning("Not all websocket connections were closed in time")
 
-    asyncio.get_event_loop().run_forever()
+    event_loop.run_until_complete(asyncio.gather(*consumers, return_exceptions=True))
 
 
 if __name__ == '__main__':
@@ -0,0 +1,122 @@
+import gzip
+import hashlib
+import json
+import threading
+from collections import OrderedDict
+from typing import Callable, Hashable, Optional
+
+from flask import Request, Response
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# smaller payloads are not worth compressing (and usually fit into one packet anyway)
+_MIN_COMPRESS_SIZE = 1024
+
+_MAX_PAYLOADS = 64
+
+
+class Payload:
+    """
+    A JSON response that is serialized and compressed once and then sent to every client asking for it
+    """
+
+    def __init__(self, data):
+        self.body = json.dumps(data, separators=(",", ":")).encode("utf-8")
+        self.etag = hashlib.blake2b(self.body, digest_size=12).hexdigest()
+        self.encodings = {}
+
+        if len(self.body) >= _MIN_COMPRESS_SIZE:
+            self.encodings["gzip"] = gzip.compress(self.body, compresslevel=6, mtime=0)
+            if brotli is not None:
+                self.encodings["br"] = brotli.compress(self.body, quality=5)
+
+    def response(self, request: Request, status: int = 200) -> Response:
+        """
+        Creates the response for a request, either 304 Not Modified if the client has the payload already or the
+        payload in the best encoding the client accepts
+
+        :param request: The flask request
+        :param status: The status code if the payload is sent
+        :return: The flask response
+        """
+
+        # weak, since the same ETag is used for all encodings of the payload
+        if request.if_none_match.contains_weak(self.etag):
+            response = Response(status=304)
+        else:
+            body = self.body
+            encoding = None
+            for name in ("br", "gzip"):
+                if name in self.encodings and request.accept_encodings[name]:
+                    body = self.encodings[name]
+                    encoding = name
+                    break
+
+            response = Response(body, status=status, mimetype="application/json")
+            if encoding is not None:
+                response.headers["Content-Encoding"] = encoding
+
+        response.set_etag(self.etag, weak=True)
+        response.headers["Vary"] = "Accept-Encoding"
+        # clients may keep the payload, but have to ask whether it is still current
+        response.headers["Cache-Control"] = "no-cache"
+        return response
+
+
+_lock = threading.Lock()
+_payloads: "OrderedDict[Hashable, Payload]" = OrderedDict()
+_pending = {}
+
+
+def get(key: Hashable, version: Hashable, build: Callable[[], object]) -> Payload:
+    """
+    Returns the payload for a key, it is only built again if the version changed
+
+    Concurrent requests for a payload that is being built wait for it instead of building it themselves.
+
+    :param key: Identifies the payload (e.g. the route and its arguments)
+    :param version: The version of the data the payload is built from (e.g. Song.version)
+    :param build: Returns the data for the payload, it is serialized with json
+    :return: The payload
+    """
+
+    cache_key = (key, version)
+
+    with _lock:
+        payload = _payloads.get(cache_key)
+        if payload is not None:
+            _payloads.move_to_end(cache_key)
+            return payload
+
+        event: Optional[threading.Event] = _pending.get(cache_key)
+        building = event is None
+        if building:
+            event = _pending[cache_key] = threading.Event()
+
+    if not building:
+        event.wait()
+        with _lock:
+            payload = _payloads.get(cache_key)
+        if payload is not None:
+            return payload
+        # building failed in the other thread, try it here
+        return Payload(build())
+
+    try:
+        payload = Payload(build())
+        with _lock:
+            # older versions of the payload will not be asked for anymore
+            for stale in [k for k in _payloads if k[0] == key]:
+                del _payloads[stale]
+            _payloads[cache_key] = payload
+            while len(_payloads) > _MAX_PAYLOADS:
+                _payloads.popitem(last=False)
+    finally:
+        with _lock:
+            del _pending[cache_key]
+        event.set()
+
+    return payload
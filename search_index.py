@@ -0,0 +1,219 @@
+import bisect
+import heapq
+import re
+import threading
+import unicodedata
+from collections import OrderedDict
+from typing import Dict, List, Set, Tuple
+
+TITLE = 1
+ARTIST = 2
+
+# minimum token length before typos are tolerated, shorter tokens would match far too many words
+_MIN_FUZZY_LENGTH = 4
+
+_TOKEN_PATTERN = re.compile(r"\w+")
+
+_MAX_CACHED_RESULTS = 256
+
+
+def fold(text: str) -> str:
+    """
+    Normalizes a text for searching by removing accents and case
+
+    :param text: The text to normalize
+    :return: The normalized text
+    """
+
+    decomposed = unicodedata.normalize("NFKD", text)
+    return "".join(c for c in decomposed if not unicodedata.combining(c)).casefold()
+
+
+def tokenize(text: str) -> List[str]:
+    """
+    Splits a text into normalized search tokens
+
+    :param text: The text to split
+    :return: The tokens in the order they appear in the text
+    """
+
+    return _TOKEN_PATTERN.findall(fold(text))
+
+
+def _deletes(token: str) -> Set[str]:
+    return {token[:i] + token[i + 1:] for i in range(len(token))}
+
+
+class SearchIndex:
+    """
+    In-memory inverted index over song titles and artists.
+
+    Every query token has to match a token of the title or artist of a song, either exactly, as a prefix or with one
+    typo (using a symmetric delete index). Results are ranked by the quality of the matches.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._postings: Dict[str, Dict[str, int]] = {}
+        self._documents: Dict[str, Tuple[List[str], str]] = {}
+        self._deletes: Dict[str, Set[str]] = {}
+        self._sorted_tokens: List[str] = []
+        self._sorted_dirty = False
+        # results of recent queries, many phones tend to type the same first letters
+        self._results: OrderedDict = OrderedDict()
+
+    def __len__(self):
+        return len(self._documents)
+
+    def add(self, song_id: str, title: str, artist: str):
+        """
+        Adds a song to the index or replaces the existing entry of the song
+
+        :param song_id: The id of the song
+        :param title: The song title
+        :param artist: The artist
+        """
+
+        fields: Dict[str, int] = {}
+        for token in tokenize(title):
+            fields[token] = fields.get(token, 0) | TITLE
+        for token in tokenize(artist):
+            fields[token] = fields.get(token, 0) | ARTIST
+
+        with self._lock:
+            self._remove(song_id)
+            self._results.clear()
+
+            for token, mask in fields.items():
+                postings = self._postings.get(token)
+                if postings is None:
+                    postings = self._postings[token] = {}
+                    self._sorted_dirty = True
+
+                    if len(token) >= _MIN_FUZZY_LENGTH:
+                        for variant in _deletes(token):
+                            self._deletes.setdefault(variant, set()).add(token)
+
+                postings[song_id] = mask
+
+            self._documents[song_id] = (list(fields), fold(title))
+
+    def remove(self, song_id: str):
+        """
+        Removes a song from the index
+
+        :param song_id: The id of the song
+        """
+
+        with self._lock:
+            self._remove(song_id)
+            self._results.clear()
+
+    def _remove(self, song_id: str):
+        document = self._documents.pop(song_id, None)
+        if document is None:
+            return
+
+        for token in document[0]:
+            postings = self._postings.get(token)
+            if postings is None:
+                continue
+
+            postings.pop(song_id, None)
+            if not postings:
+                del self._postings[token]
+                self._sorted_dirty = True
+
+                if len(token) >= _MIN_FUZZY_LENGTH:
+                    for variant in _deletes(token):
+                        tokens = self._deletes.get(variant)
+                        if tokens is not None:
+                            tokens.discard(token)
+                            if not tokens:
+                                del self._deletes[variant]
+
+    def _candidates(self, query_token: str) -> Dict[str, float]:
+        """
+        Finds the indexed tokens matching a query token
+
+        :return: A dict of the matching tokens and the score of the match
+        """
+
+        candidates = {}
+
+        if self._sorted_dirty:
+            self._sorted_tokens = sorted(self._postings)
+            self._sorted_dirty = False
+
+        sorted_tokens = self._sorted_tokens
+        for i in range(bisect.bisect_left(sorted_tokens, query_token), len(sorted_tokens)):
+            token = sorted_tokens[i]
+            if not token.startswith(query_token):
+                break
+            candidates[token] = 3.0 if token == query_token else 2.0
+
+        if len(query_token) >= _MIN_FUZZY_LENGTH:
+            variants = _deletes(query_token)
+            fuzzy = set(self._deletes.get(query_token, ()))
+            for variant in variants:
+                if variant in self._postings:
+                    fuzzy.add(variant)
+                fuzzy.update(self._deletes.get(variant, ()))
+
+            for token in fuzzy:
+                candidates.setdefault(token, 1.0)
+
+        return candidates
+
+    def search(self, query: str, limit: int = 50) -> List[Tuple[str, float]]:
+        """
+        Searches the index
+
+        :param query: The search text
+        :param limit: The maximum number of results
+        :return: A list of song ids and their scores, best matches first
+        """
+
+        query_tokens = list(dict.fromkeys(tokenize(query)))
+        if not query_tokens:
+            return []
+
+        key = (tuple(query_tokens), limit)
+
+        with self._lock:
+            results = self._results.get(key)
+            if results is not None:
+                self._results.move_to_end(key)
+                return results
+
+            per_token = []
+            for query_token in query_tokens:
+                token_scores: Dict[str, float] = {}
+                for token, score in self._candidates(query_token).items():
+                    for song_id, mask in self._postings[token].items():
+                        # prefer matches in the title, that is what people usually search for
+                        weighted = score + (0.5 if mask & TITLE else 0)
+                        if weighted > token_scores.get(song_id, 0):
+                            token_scores[song_id] = weighted
+                per_token.append(token_scores)
+
+            scores = None
+
+            # the rarest tokens first, so the intersection shrinks as early as possible
+            for token_scores in sorted(per_token, key=len):
+                if scores is None:
+                    scores = dict(token_scores)
+                else:
+                    scores = {song_id: score + token_scores[song_id] for song_id, score in scores.items() if song_id in token_scores}
+
+                if not scores:
+                    break
+
+            documents = self._documents
+            results = heapq.nsmallest(limit, scores.items(), key=lambda item: (-item[1], documents[item[0]][1], item[0]))
+
+            self._results[key] = results
+            if len(self._results) > _MAX_CACHED_RESULTS:
+                self._results.popitem(last=False)
+
+            return results
@@ -1,20 +1,95 @@
 import asyncio
+import bisect
+import collections
 import json
 import logging
 import os
 import re
 import shutil
-import tempfile
+import stat
+import sys
+import threading
+import time
 import uuid
-import chardet
-from typing import Optional, List
+from concurrent.futures import ThreadPoolExecutor
 
-import eyed3
-import requests
+from typing import Optional, List, Dict, Tuple, Callable
+
+import httpx
 from bs4 import BeautifulSoup
 
+import audio_probe
 import config
+import ultrastar
 import usdb
+from search_index import SearchIndex
+from song_index import SongIndex, UNKNOWN_DURATION
+
+# lines of the output of yt-dlp and ffmpeg that are kept for error messages
+OUTPUT_TAIL_LINES = 50
+
+_LINE_BREAK_PATTERN = re.compile(r"\r\n|\r|\n")
+
+# yt-dlp prints its progress in this format (values are 'NA' if unknown)
+_YT_DLP_PROGRESS_PREFIX = "wingman-progress"
+_YT_DLP_PROGRESS_TEMPLATE = f"download:{_YT_DLP_PROGRESS_PREFIX} %(progress.downloaded_bytes)s %(progress.total_bytes)s %(progress.total_bytes_estimate)s %(progress.speed)s %(progress.eta)s"
+
+_FFMPEG_DURATION_PATTERN = re.compile(r"Duration: (\d+):(\d+):(\d+(?:\.\d+)?)")
+
+
+def _complete_file(files: List[str], name: str) -> Optional[str]:
+    """
+    Returns the first of the files with the given name and a single extension (e.g. audio.webm), leftovers of yt-dlp
+    like audio.webm.part-Frag3 or audio.webm.ytdl are not complete
+    """
+
+    return next((f for f in files if re.fullmatch(rf"{re.escape(name)}\.[A-Za-z0-9]+", f)), None)
+
+
+def _number(value: str) -> Optional[float]:
+    try:
+        return float(value)
+    except ValueError:
+        return None
+
+
+def _ffmpeg_progress_parser(on_progress: Callable[[dict], None]) -> Callable[[str], None]:
+    """
+    Returns a line callback for ffmpeg with '-progress pipe:1' that reports the percentage, speed and ETA
+    """
+
+    state = {"duration": None, "speed": None}
+
+    def on_line(line: str):
+        match = _FFMPEG_DURATION_PATTERN.search(line)
+        if match is not None and state["duration"] is None:
+            hours, minutes, seconds = match.groups()
+            state["duration"] = int(hours) * 3600 + int(minutes) * 60 + float(seconds)
+            return
+
+        key, _, value = line.partition("=")
+        if key == "speed":
+            state["speed"] = _number(value.strip().rstrip("x"))
+        elif key == "out_time_us" and state["duration"]:
+            position = (_number(value) or 0) / 1000000
+            progress = {"percent": min(100 * position / state["duration"], 100)}
+            if state["speed"]:
+                progress["speed"] = state["speed"]
+                progress["eta"] = max(state["duration"] - position, 0) / state["speed"]
+            on_progress(progress)
+        elif key == "progress" and value == "end":
+            on_progress({"percent": 100})
+
+    return on_line
+
+
+def _mtime(directory: str, file_name: Optional[str]) -> Optional[int]:
+    if not file_name:
+        return None
+    try:
+        return os.stat(os.path.join(directory, file_name)).st_mtime_ns
+    except OSError:
+        return None
 
 
 class DownloadException(Exception):
@@ -22,9 +97,31 @@ class DownloadException(Exception):
 
 
 class Song:
+    # there can be tens of thousands of songs, so they have no __dict__ and share equal strings (artists, file names)
+    __slots__ = ("directory", "title", "artist", "usdb_id", "cover", "mp3", "source", "id", "_duration", "_duration_probed")
+
     songs = {}
-    usdb_ids = set()
-    php_session_id = None
+    directories = {}
+    # secondary index, usdb ids usually belong to a single song (or a local and a network copy)
+    by_usdb_id: Dict[int, Tuple['Song', ...]] = {}
+    network_usdb_dirs = {}
+    MISSING_ID_TTL = 300
+    MAX_MISSING_IDS = 1024
+    # ids that were looked up but not found, in the order of the lookups
+    _missing_ids = collections.OrderedDict()
+    scan_progress = {
+        "running": False,
+        "roots": {}
+    }
+    index: Optional[SongIndex] = None
+    version = 0
+    ROW_FIELDS = ["id", "title", "artist", "usdb_id", "duration", "source"]
+    _songs_lock = threading.Lock()
+    _sorted_cache = {}
+    search_index = SearchIndex()
+    _stage_limits = {}
+    _scan_lock = threading.Lock()
+    _duration_executor = ThreadPoolExecutor(max_workers=max(1, config.duration_workers), thread_name_prefix="duration")
 
     @staticmethod
     def create_valid_dir_name(s):
@@ -46,118 +143,614 @@ class Song:
 
     @classmethod
     def load_songs(cls):
-        # Check local path first
-        local_songs_dir = config.usdx_songs_dir
-        network_songs_dir = config.network_songs_dir if hasattr(config, 'network_songs_dir') else None
+        """
+        Scans the local and network song directories and registers every song found.
 
-        # Try to load from local path
-        try:
-            for subdir in os.listdir(local_songs_dir):
-                subdir_path = os.path.join(local_songs_dir, subdir)
-                cls._process_song_directory(subdir_path)
-        except Exception as e:
-            logging.error(f"Error loading songs from local path {local_songs_dir}: {e}")
+        Each root is scanned by its own thread pool so a slow network share does not hold up the local library.
+        Songs are added to Song.songs as soon as their directory is processed, the progress can be followed with
+        Song.get_scan_progress(). Blocks until all roots have been scanned.
+        """
+
+        roots = [
+            (config.usdx_songs_dir, "local", config.scan_workers_local),
+            (config.network_songs_dir if hasattr(config, 'network_songs_dir') else None, "net", config.scan_workers_network)
+        ]
+
+        with cls._scan_lock:
+            cls.scan_progress = {
+                "running": True,
+                "roots": {}
+            }
+
+        if cls.index is None:
+            try:
+                cls.index = SongIndex(config.song_index_file)
+            except Exception as e:
+                logging.error(f"Could not open the song index '{config.song_index_file}', scanning without it: {e}")
+
+        cached = cls.index.load() if cls.index is not None else {}
+
+        threads = []
+        for songs_dir, source, workers in roots:
+            if songs_dir is None:
+                continue
+
+            thread = threading.Thread(target=cls._scan_root, args=(songs_dir, source, workers, cached), name=f"scan-{source}", daemon=True)
+            thread.start()
+            threads.append(thread)
+
+        for thread in threads:
+            thread.join()
+
+        with cls._scan_lock:
+            cls.scan_progress["running"] = False
+
+        logging.info(f"Loaded {len(cls.songs)} songs")
+
+        cls.probe_durations()
+
+    @classmethod
+    def load_songs_in_background(cls, on_finished: Optional[Callable[[], None]] = None) -> threading.Thread:
+        """
+        Starts Song.load_songs in a daemon thread so the servers can come up while the library is scanned
+
+        :param on_finished: Optional callback that is called in the scan thread once the scan is done
+        :return: The thread running the scan
+        """
+
+        def run():
+            cls.load_songs()
+            if on_finished is not None:
+                on_finished()
+
+        thread = threading.Thread(target=run, name="song-scan", daemon=True)
+        thread.start()
+        return thread
+
+    @classmethod
+    def get_scan_progress(cls) -> dict:
+        """
+        Returns a copy of the current scan progress
+
+        :return: A dict with the overall state and the progress per songs directory
+        """
+
+        with cls._scan_lock:
+            return {
+                "running": cls.scan_progress["running"],
+                "roots": {k: dict(v) for k, v in cls.scan_progress["roots"].items()}
+            }
+
+    @classmethod
+    def _scan_root(cls, songs_dir, source: str, workers: int, cached: Dict[str, dict]):
+        """
+        Processes all song directories of one root with a bounded thread pool
+
+        :param songs_dir: The songs directory to scan
+        :param source: 'local' or 'net'
+        :param workers: The maximum number of directories processed in parallel for this root
+        :param cached: The entries of the song index by directory
+        """
+
+        progress = {
+            "directory": str(songs_dir),
+            "total": None,
+            "processed": 0,
+            "finished": False,
+            "error": None
+        }
+        with cls._scan_lock:
+            cls.scan_progress["roots"][source] = progress
 
-        # Try to load from network path
         try:
-            for subdir in os.listdir(network_songs_dir):
-                subdir_path = os.path.join(network_songs_dir, subdir)
-                cls._process_song_directory(subdir_path)
+            subdirs = os.listdir(songs_dir)
         except Exception as e:
-            logging.error(f"Error loading songs from network path {network_songs_dir}: {e}")
+            logging.error(f"Error loading songs from {source} path {songs_dir}: {e}")
+            with cls._scan_lock:
+                progress["error"] = str(e)
+                progress["finished"] = True
+            return
+
+        with cls._scan_lock:
+            progress["total"] = len(subdirs)
+
+        def process(subdir):
+            subdir_path = os.path.join(songs_dir, subdir)
+            try:
+                return cls._process_song_directory(subdir_path, source, cached.get(subdir_path))
+            finally:
+                with cls._scan_lock:
+                    progress["processed"] += 1
+
+        changed = []
+        found = []
+        with ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix=f"scan-{source}") as executor:
+            # consume the results to surface unexpected errors in the log
+            for future in [executor.submit(process, subdir) for subdir in subdirs]:
+                try:
+                    entry = future.result()
+                except Exception as e:
+                    logging.exception(f"Error while scanning {songs_dir}: {e}")
+                    continue
+
+                if entry is not None:
+                    found.append(entry["directory"])
+                    if cached.get(entry["directory"]) != entry:
+                        changed.append(entry)
+
+        if cls.index is not None:
+            try:
+                cls.index.put(changed)
+                cls.index.prune(str(songs_dir), found)
+            except Exception as e:
+                logging.error(f"Could not update the song index for {songs_dir}: {e}")
+
+        with cls._scan_lock:
+            progress["finished"] = True
+
+        logging.info(f"Finished scanning {source} songs in {songs_dir}")
 
     @classmethod
-    def _process_song_directory(cls, subdir_path):
-        """Helper method to process a single song directory"""
-        if not os.path.isdir(subdir_path):
-            return
+    def _process_song_directory(cls, subdir_path, source: str = "local", cached: Optional[dict] = None) -> Optional[dict]:
+        """
+        Helper method to process a single song directory
+
+        If the modification times of the directory and its txt file match the cached index entry, the song is created
+        from the index without opening any file.
+
+        :param subdir_path: The song directory
+        :param source: 'local' or 'net'
+        :param cached: The index entry for this directory from the last scan
+        :return: The index entry for the directory or None if it does not contain a valid song
+        """
+
+        try:
+            dir_stat = os.stat(subdir_path)
+        except OSError:
+            return None
+
+        if not stat.S_ISDIR(dir_stat.st_mode):
+            return None
 
         try:
+            if source == "net" and cached is not None and cached["usdb_id"] is not None:
+                with cls._songs_lock:
+                    cls.network_usdb_dirs[str(cached["usdb_id"])] = subdir_path
+
+            if cached is not None and cached["dir_mtime"] == dir_stat.st_mtime_ns:
+                try:
+                    txt_mtime = os.stat(os.path.join(subdir_path, cached["txt_file"])).st_mtime_ns
+                except OSError:
+                    txt_mtime = None
+
+                if txt_mtime == cached["txt_mtime"]:
+                    # the audio file may have been replaced since it could not be read
+                    if cached["duration"] == UNKNOWN_DURATION and _mtime(subdir_path, cached["mp3"]) != cached["audio_mtime"]:
+                        cached = {**cached, "duration": None, "audio_mtime": None}
+
+                    cls(subdir_path, cached["title"], cached["artist"], cached["usdb_id"], cached["cover"], cached["mp3"], source=source, duration=cached["duration"])
+                    return cached
+
             usdb_id = None
             if os.path.isfile(os.path.join(subdir_path, "usdb_data.json")):
                 with open(os.path.join(subdir_path, "usdb_data.json")) as file:
                     usdb_data = json.loads(file.read())
                     usdb_id = usdb_data.get("id")
 
+            if source == "net" and usdb_id is not None:
+                with cls._songs_lock:
+                    cls.network_usdb_dirs[str(usdb_id)] = subdir_path
+
             txt_files = [f for f in os.listdir(subdir_path) if f.endswith('.txt')]
 
             if not txt_files:
-                return
+                return None
 
             txt_path = os.path.join(subdir_path, txt_files[0])
 
-            with open(txt_path, 'rb') as file:
-                encoding = chardet.detect(file.read())['encoding']
+            headers, encoding = ultrastar.read_headers(txt_path)
 
-            if encoding != 'utf-8':
+            if encoding not in ('utf-8', 'utf-8-sig'):
                 logging.warning(f"Wrong encoding. Is {encoding} instead of utf-8 for '{os.path.join(subdir_path, txt_files[0])}'")
 
-            with open(txt_path, 'r', encoding=encoding) as file:
-                txt = file.read()
-
-            match = re.search(r'#TITLE:(.*)\n', txt)
-            if match:
-                title = match.group(1)
-            else:
+            title = headers.get("TITLE")
+            if not title:
                 logging.warning(f"No title for {subdir_path}")
-                return
+                return None
 
-            match = re.search(r'#ARTIST:(.*)\n', txt)
-            if match:
-                artist = match.group(1)
-            else:
+            artist = headers.get("ARTIST")
+            if not artist:
                 logging.warning(f"No artist for {subdir_path}")
-                return
+                return None
+
+            cover = headers.get("COVER") or None
+            mp3 = headers.get("MP3") or None
+
+            song = cls(subdir_path, title, artist, usdb_id, cover, mp3, source=source)
+
+            return {
+                "directory": subdir_path,
+                "root": os.path.dirname(subdir_path),
+                "dir_mtime": dir_stat.st_mtime_ns,
+                "txt_file": txt_files[0],
+                "txt_mtime": os.stat(txt_path).st_mtime_ns,
+                "title": title,
+                "artist": artist,
+                "cover": cover,
+                "mp3": mp3,
+                "usdb_id": usdb_id,
+                "duration": song._duration,
+                "encoding": encoding,
+                "audio_mtime": None
+            }
+        except Exception as e:
+            logging.exception(f"Could not process song in '{subdir_path}': {e}")
+            return None
 
-            match = re.search(r'#COVER:(.*)\n', txt)
-            cover = None
-            if match:
-                cover = match.group(1)
+    @classmethod
+    def _stage_limit(cls, stage: str) -> asyncio.Semaphore:
+        """
+        Returns the semaphore limiting how many downloads can be in a stage of the download pipeline at the same time
 
-            match = re.search(r'#MP3:(.*)\n', txt)
-            mp3 = None
-            if match:
-                mp3 = match.group(1)
+        :param stage: 'network', 'youtube' or 'ffmpeg'
+        :return: The semaphore of the stage
+        """
 
-            cls(subdir_path, title, artist, usdb_id, cover, mp3)
-        except Exception as e:
-            logging.exception(f"Could not process song in '{subdir_path}': {e}")
+        semaphore = cls._stage_limits.get(stage)
+        if semaphore is None:
+            semaphore = cls._stage_limits[stage] = asyncio.Semaphore({
+                "network": config.download_network_limit,
+                "youtube": config.download_youtube_limit,
+                "ffmpeg": config.download_ffmpeg_limit
+            }[stage])
+        return semaphore
 
     @classmethod
-    async def download(cls, id):
+    async def _run_process(cls, name: str, *args, cwd: str, on_line: Optional[Callable[[str], None]] = None):
+        """
+        Runs a subprocess without blocking the event loop
+
+        The output is read line by line while the process is running, only the last lines are kept for the error
+        message.
+
+        :param name: The name of the process for error messages
+        :param args: The command and its arguments
+        :param cwd: The working directory
+        :param on_line: Optional callback for every line of stdout and stderr (e.g. to parse the progress)
+        :raises DownloadException: If the process fails
+        """
+
+        process = await asyncio.create_subprocess_exec(
+            *args,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE,
+            cwd=cwd
+        )
+
+        tail = collections.deque(maxlen=OUTPUT_TAIL_LINES)
+
+        async def read_lines(stream: asyncio.StreamReader):
+            buffer = ""
+            while True:
+                chunk = await stream.read(4096)
+                if not chunk:
+                    break
+
+                # progress output often ends lines with \r only
+                lines = _LINE_BREAK_PATTERN.split(buffer + chunk.decode(errors="replace"))
+                buffer = lines.pop()
+                for line in lines:
+                    if line:
+                        tail.append(line)
+                        if on_line is not None:
+                            on_line(line)
+
+            if buffer:
+                tail.append(buffer)
+                if on_line is not None:
+                    on_line(buffer)
+
         try:
-            response = usdb.session.post(f"https://usdb.animux.de/index.php?link=gettxt&id={id}", headers={"Cookie": cls.php_session_id}, data={"wd": "1"})
+            await asyncio.gather(read_lines(process.stdout), read_lines(process.stderr))
+            await process.wait()
+        except asyncio.CancelledError:
+            # do not leave the process running when the download is aborted
+            if process.returncode is None:
+                process.kill()
+            raise
+
+        if process.returncode != 0:
+            output = "\n".join(tail)
+            raise DownloadException(f"{name} failed with code {process.returncode}, output: {output}")
+
+    @classmethod
+    async def _fetch_txt(cls, id) -> str:
+        """
+        Downloads the txt of a song from usdb.animux.de
+
+        :param id: The usdb id
+        :return: The content of the txt
+        """
+
+        try:
+            async with cls._stage_limit("network"):
+                response = await usdb.request_async("POST", f"/index.php?link=gettxt&id={id}", data={"wd": "1"})
             response.raise_for_status()
-        except requests.exceptions.RequestException as e:
+        except httpx.HTTPError as e:
             raise DownloadException(f"Failed to retrieve song data: {e}")
 
-        soup = BeautifulSoup(response.content, 'html.parser')
+        soup = await asyncio.get_running_loop().run_in_executor(None, BeautifulSoup, response.content, 'html.parser')
 
         # Extract the value of the input element with the name "txt"
         input_element = soup.find('input', {'name': 'txt'})
 
         if input_element:
-            txt = input_element['value'].replace("\r\n", "\n")
+            return input_element['value'].replace("\r\n", "\n")
         else:
             raise DownloadException(f"txt for {id} not found on usdb.animux.de. Are you logged in?")
 
-        # TODO: get only the id, load everything here
-        match = re.search(r'#TITLE:(.*)\n', txt)
-        if match:
-            title = match.group(1)
+    @classmethod
+    async def _fetch_cover(cls, id, tempdir: str):
+        loop = asyncio.get_running_loop()
+
+        # the cover is usually cached already, since it was shown in the download list
+        try:
+            async with cls._stage_limit("network"):
+                cover = await loop.run_in_executor(None, usdb.get_cover, id)
+        except httpx.HTTPError as e:
+            raise DownloadException(f"Failed to download the cover: {e}")
+
+        if cover is None:
+            logging.warning(f"Song {id} has no cover on usdb.animux.de")
+            return
+
+        await loop.run_in_executor(None, shutil.copyfile, cover, os.path.join(tempdir, "cover.jpg.part"))
+        os.replace(os.path.join(tempdir, "cover.jpg.part"), os.path.join(tempdir, "cover.jpg"))
+
+    @classmethod
+    async def _download_video(cls, url: str, tempdir: str, video: bool = True, audio: bool = True, on_progress: Optional[Callable[[dict], None]] = None):
+        """
+        Downloads the video and the audio stream of a song as separate files, so the audio does not have to be
+        extracted from the merged video afterwards
+
+        :param url: The youtube url
+        :param tempdir: The directory to download to
+        :param video: Download the video stream
+        :param audio: Download the audio stream
+        :param on_progress: Optional callback for the combined progress of both streams (percent, speed, eta)
+        """
+
+        processes = {}
+        if video:
+            processes["video"] = ("youtube-dl", config.youtube_dl, "--continue", "--newline", "--progress-template", _YT_DLP_PROGRESS_TEMPLATE, "-o", "video.mp4", "-f", "bestvideo[ext=mp4][height<=1080]/best[ext=mp4][height<=1080]/best[height<=1080]", url)
+        if audio:
+            processes["audio"] = ("youtube-dl", config.youtube_dl, "--continue", "--newline", "--progress-template", _YT_DLP_PROGRESS_TEMPLATE, "-o", "audio.%(ext)s", "-f", "bestaudio[ext=m4a]/bestaudio/best", url)
+
+        if not processes:
+            return
+
+        # the latest (downloaded bytes, total bytes, speed, eta) of each stream
+        streams: Dict[str, Tuple[float, Optional[float], Optional[float], Optional[float]]] = {}
+
+        def parser(stream: str) -> Callable[[str], None]:
+            def on_line(line: str):
+                if not line.startswith(_YT_DLP_PROGRESS_PREFIX):
+                    return
+
+                values = [_number(value) for value in line.split()[1:6]]
+                if len(values) < 5:
+                    return
+
+                downloaded, total, estimate, speed, eta = values
+                streams[stream] = (downloaded or 0, total or estimate, speed, eta)
+
+                if on_progress is None:
+                    return
+
+                progress = {}
+                totals = [total for _, total, _, _ in streams.values()]
+                if len(streams) == len(processes) and all(totals):
+                    progress["percent"] = 100 * sum(downloaded for downloaded, _, _, _ in streams.values()) / sum(totals)
+
+                speeds = [speed for _, _, speed, _ in streams.values() if speed is not None]
+                if speeds:
+                    progress["speed"] = sum(speeds)
+
+                etas = [eta for _, _, _, eta in streams.values() if eta is not None]
+                if etas:
+                    progress["eta"] = max(etas)
+
+                on_progress(progress)
+
+            return on_line
+
+        async with cls._stage_limit("youtube"):
+            await asyncio.gather(*(cls._run_process(*args, cwd=tempdir, on_line=parser(stream)) for stream, args in processes.items()))
+
+    @classmethod
+    async def _extract_audio(cls, tempdir: str, on_progress: Optional[Callable[[dict], None]] = None) -> str:
+        """
+        Creates the audio file of the song from the downloaded audio stream.
+
+        With the audio format 'copy', the stream is kept as it is (or only remuxed) if USDX can play it, otherwise it is
+        encoded to mp3.
+
+        :param tempdir: The download directory containing the audio stream
+        :param on_progress: Optional callback for the progress of ffmpeg (percent, speed, eta)
+        :return: The file name of the audio file
+        """
+
+        downloaded = _complete_file(os.listdir(tempdir), "audio")
+        if downloaded is None:
+            raise DownloadException("youtube-dl did not download an audio stream")
+
+        extension = downloaded.rsplit(".", 1)[-1].lower()
+        on_line = _ffmpeg_progress_parser(on_progress) if on_progress is not None else None
+
+        if config.audio_format == "copy":
+            if extension in ("m4a", "mp3", "ogg"):
+                os.replace(os.path.join(tempdir, downloaded), os.path.join(tempdir, f"song.{extension}"))
+                return f"song.{extension}"
+
+            # opus/vorbis in webm and aac in mp4 only need a new container
+            remux = {"webm": "ogg", "opus": "ogg", "mp4": "m4a"}.get(extension)
+            if remux is not None:
+                async with cls._stage_limit("ffmpeg"):
+                    await cls._run_process("ffmpeg", config.ffmpeg, "-y", "-nostats", "-progress", "pipe:1", "-i", downloaded, "-vn", "-acodec", "copy", f"song.{remux}", cwd=tempdir, on_line=on_line)
+                os.remove(os.path.join(tempdir, downloaded))
+                return f"song.{remux}"
+
+        async with cls._stage_limit("ffmpeg"):
+            await cls._run_process(
+                "ffmpeg",
+                config.ffmpeg, "-y", "-nostats", "-progress", "pipe:1", "-i", downloaded, "-vn", "-acodec", "libmp3lame", "-ac", "2", "-ab", "160k", "-ar", "48000", "song.mp3",
+                cwd=tempdir,
+                on_line=on_line
+            )
+        os.remove(os.path.join(tempdir, downloaded))
+        return "song.mp3"
+
+    @classmethod
+    def _finalize(cls, stagedir: str, directory: str, txt: str, title: str, artist: str, id, audio: str, cover: Optional[str]) -> 'Song':
+        """
+        Writes the song files into the staging directory, moves it into the songs directory in one step and registers
+        the song (blocking)
+        """
+
+        name = os.path.basename(directory)
+
+        with open(os.path.join(stagedir, "usdb_data.json"), "w+") as file:
+            file.write(json.dumps({
+                "id": id
+            }))
+
+        with open(os.path.join(stagedir, f"{name}.txt"), "w+") as file:
+            file.writelines("#VIDEO:video.mp4\n")
+            file.writelines(f"#MP3:{audio}\n")
+            if cover:
+                file.writelines(f"#COVER:{cover}\n")
+            # TODO: Background
+            # file.writelines("#BACKGROUND:background.jpg\n")
+            for line in txt.split("\n"):
+                if not any(line.startswith(s) for s in ["#VIDEO", "#MP3", "#COVER", "#BACKGROUND"]):
+                    file.writelines(line + "\n")
+
+        # the original txt and leftovers of interrupted downloads do not belong into the song directory
+        keep = {"usdb_data.json", f"{name}.txt", "video.mp4", cover, audio}
+        for file_name in os.listdir(stagedir):
+            if file_name not in keep:
+                os.remove(os.path.join(stagedir, file_name))
+
+        if os.path.exists(directory):
+            raise DownloadException(f"directory '{directory}' exists")
+
+        try:
+            # a rename if the cache is on the same file system as the songs, otherwise a single copy
+            shutil.move(stagedir, directory)
+        except BaseException:
+            shutil.rmtree(directory, ignore_errors=True)
+            raise
+
+        return cls(directory, title, artist, id, cover, audio, source="local")
+
+    @classmethod
+    def staging_dir(cls, id) -> str:
+        """
+        Returns the directory in which a song is downloaded before it is moved to the songs directory.
+
+        The directory survives restarts, so an interrupted download can continue with the files it already has.
+
+        :param id: The usdb id of the song
+        :return: The path of the directory
+        """
+
+        return os.path.join(config.cache_dir, "staging", str(id))
+
+    @classmethod
+    def clean_staging(cls, keep: List[int]):
+        """
+        Removes the staging directories of all downloads except the given ones
+
+        :param keep: The usdb ids of the downloads whose files should be kept
+        """
+
+        staging = os.path.join(config.cache_dir, "staging")
+        if not os.path.isdir(staging):
+            return
+
+        keep = {str(id) for id in keep}
+        for name in os.listdir(staging):
+            if name not in keep:
+                logging.info(f"Removing files of the unfinished download {name}")
+                shutil.rmtree(os.path.join(staging, name), ignore_errors=True)
+
+    @classmethod
+    async def download(cls, id, on_stage: Optional[Callable[[str], None]] = None, on_progress: Optional[Callable[[str, dict], None]] = None):
+        """
+        Downloads a song from usdb.animux.de with its cover, video and audio.
+
+        The download is split into stages (txt and cover fetch, yt-dlp, ffmpeg, finalize) that are limited separately,
+        so many queued downloads use the network and the CPU in parallel without blocking the event loop.
+        All files are downloaded to the staging directory of the song. Stages whose results are already there are
+        skipped and yt-dlp continues partial downloads, so downloading a song again after an interruption only
+        fetches what is missing.
+
+        :param id: The usdb id of the song
+        :param on_stage: Optional callback that is called with the name of each stage when it is started
+        :param on_progress: Optional callback that is called with the stage and its progress (percent, speed and eta
+            if known), at most every progress_interval seconds
+        :return: The new song
+        """
+
+        loop = asyncio.get_running_loop()
+        stagedir = cls.staging_dir(id)
+        os.makedirs(stagedir, exist_ok=True)
+
+        last_progress = {}
+
+        def stage(name):
+            if on_stage is not None:
+                on_stage(name)
+            if on_progress is not None:
+                on_progress(name, {})
+
+        def progress(name) -> Optional[Callable[[dict], None]]:
+            if on_progress is None:
+                return None
+
+            def report(info: dict):
+                now = time.monotonic()
+                if info.get("percent", 0) < 100 and now - last_progress.get(name, 0) < config.progress_interval:
+                    return
+                last_progress[name] = now
+                on_progress(name, info)
+
+            return report
+
+        stage("txt")
+        txt_path = os.path.join(stagedir, "usdb.txt")
+        if os.path.isfile(txt_path):
+            with open(txt_path, encoding="utf-8") as file:
+                txt = file.read()
         else:
+            txt = await cls._fetch_txt(id)
+
+            with open(txt_path, "w", encoding="utf-8") as file:
+                file.write(txt)
+
+        # TODO: get only the id, load everything here
+        headers = ultrastar.parse_headers(txt)
+
+        title = headers.get("TITLE")
+        if not title:
             raise DownloadException("missing name")
 
-        match = re.search(r'#ARTIST:(.*)\n', txt)
-        if match:
-            artist = match.group(1)
-        else:
+        artist = headers.get("ARTIST")
+        if not artist:
             raise DownloadException("missing artist")
 
-        match = re.search(r'#VIDEO:(.*)\n', txt)
-        if match:
-            video = match.group(1)
-        else:
+        video = headers.get("VIDEO")
+        if not video:
             raise DownloadException("missing video")
 
         if id is None:
@@ -172,162 +765,330 @@ class Song:
 
         logging.info(f"Saving {artist} - {title} ({id}) to {directory}")
 
-        with tempfile.TemporaryDirectory() as tempdir:
-            with open(os.path.join(tempdir, f"usdb_data.json"), "w+") as file:
-                file.write(json.dumps({
-                    "id": id
-                }))
-
-            with open(os.path.join(tempdir, f"{sanitized_name}.txt"), "w+") as file:
-                file.writelines("#VIDEO:video.mp4\n")
-                file.writelines("#MP3:song.mp3\n")
-                file.writelines("#COVER:cover.jpg\n")
-                # TODO: Background
-                # file.writelines("#BACKGROUND:background.jpg\n")
-                for line in txt.split("\n"):
-                    if not any(line.startswith(s) for s in ["#VIDEO", "#MP3", "#COVER", "#BACKGROUND"]):
-                        file.writelines(line + "\n")
-
-            match = re.search(r'[va]=([a-zA-Z0-9_-]+)', video)
-            if match:
-                url = f"https://www.youtube.com/watch?v={match.group(1)}"
-            else:
-                raise DownloadException(f"no video url found in txt")
-
-            process = await asyncio.create_subprocess_exec(
-                "curl", "-o", "cover.jpg", f"https://usdb.animux.de/data/cover/{id}.jpg",
-                stdout=asyncio.subprocess.PIPE,
-                stderr=asyncio.subprocess.PIPE,
-                cwd=tempdir
-            )
-            stdout, stderr = await process.communicate()
-
-            if process.returncode != 0:
-                raise DownloadException(f"cover download failed with code {process.returncode}, stdout: {stdout.decode()}, stderr: {stderr.decode()}")
-
-            # try:
-            #     subprocess.run(["curl", "-o", "cover.jpg", f"https://usdb.animux.de/data/cover/{id}.jpg"], cwd=tempdir, check=True)
-            # except Exception as e:
-            #     raise DownloadException(f"cover download failed: {e}")
-
-            process = await asyncio.create_subprocess_exec(
-                # config.youtube_dl, "-o", "video.mp4", "--format", "mp4", url,
-                config.youtube_dl, "-o", "video.mp4", "-f", "bestvideo[ext=mp4][height<=1080]+bestaudio[ext=m4a]/best[ext=mp4][height<=1080]/best[height<=1080]", url,
-                stdout=asyncio.subprocess.PIPE,
-                stderr=asyncio.subprocess.PIPE,
-                cwd=tempdir
-            )
-            stdout, stderr = await process.communicate()
+        match = re.search(r'[va]=([a-zA-Z0-9_-]+)', video)
+        if match:
+            url = f"https://www.youtube.com/watch?v={match.group(1)}"
+        else:
+            raise DownloadException(f"no video url found in txt")
+
+        # files left from an interrupted download, an audio stream that is still there was not converted completely
+        files = [f for f in os.listdir(stagedir) if not f.endswith(".part")]
+        audio_stream = _complete_file(files, "audio") is not None
+        audio = None if audio_stream else _complete_file(files, "song")
+
+        # the cover is fetched while yt-dlp is running
+        stage("media")
+        tasks = [asyncio.ensure_future(cls._download_video(url, stagedir, video="video.mp4" not in files, audio=audio is None and not audio_stream, on_progress=progress("media")))]
+        if "cover.jpg" not in files:
+            tasks.append(asyncio.ensure_future(cls._fetch_cover(id, stagedir)))
+        try:
+            await asyncio.gather(*tasks)
+        except BaseException:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            raise
 
-            if process.returncode != 0:
-                raise DownloadException(f"youtube-dl failed with code {process.returncode}, stdout: {stdout.decode()}, stderr: {stderr.decode()}")
+        if audio is None:
+            stage("audio")
+            audio = await cls._extract_audio(stagedir, on_progress=progress("audio"))
 
-            # try:
-            #     subprocess.run([config.youtube_dl, "-o", "video.mp4", "--format", "mp4", url], cwd=tempdir, check=True)
-            # except Exception as e:
-            #     raise DownloadException(f"youtube-dl failed: {e}")
+        stage("finalize")
+        cover = "cover.jpg" if os.path.exists(os.path.join(stagedir, "cover.jpg")) else None
+        return await loop.run_in_executor(None, cls._finalize, stagedir, directory, txt, title, artist, id, audio, cover)
 
+    @classmethod
+    def sorted_usdb_ids(cls) -> List[int]:
+        """
+        Returns the usdb ids of all songs in ascending order
+        """
 
-            # BUG: failing on extracting the audio from the music video
-            # process = await asyncio.create_subprocess_shell(
-            process = await asyncio.create_subprocess_exec(
-                config.ffmpeg, "-i", "video.mp4", "-vn", "-acodec", "libmp3lame", "-ac", "2", "-ab", "160k", "-ar", "48000", "song.mp3",
-                stdout=asyncio.subprocess.PIPE,
-                stderr=asyncio.subprocess.PIPE,
-                cwd=tempdir
-            )
-            stdout, stderr = await process.communicate()
+        # the scan and the watcher change the index while the ids are read
+        with cls._songs_lock:
+            ids = list(cls.by_usdb_id)
+        return sorted(ids)
+
+    @classmethod
+    def sorted_songs(cls, sort: str = "title") -> Tuple[List[tuple], List['Song']]:
+        """
+        Returns all songs sorted by title or artist.
 
-            if process.returncode != 0:
-                raise DownloadException(f"ffmpeg failed with code {process.returncode}, stdout: {stdout.decode()}, stderr: {stderr.decode()}")
+        The sorted list is cached until the library changes.
 
-            # try:
-            #     subprocess.run([config.ffmpeg, "-i", "video.mp4", "-vn", "-acodec", "libmp3lame", "-ac", "2", "-ab", "160k", "-ar", "48000", "song.mp3"], cwd=tempdir, check=True)
-            # except Exception as e:
-            #     raise DownloadException(f"ffmpeg failed: {e}")
+        :param sort: 'title' or 'artist'
+        :return: A tuple of the ascending sort keys and the songs in the same order
+        """
 
-            os.makedirs(directory)
+        with cls._songs_lock:
+            version = cls.version
+            cached = cls._sorted_cache.get(sort)
+            if cached is not None and cached[0] == version:
+                return cached[1], cached[2]
+            songs = list(cls.songs.values())
+
+        if sort == "artist":
+            entries = sorted(((s.artist.casefold(), s.title.casefold(), str(s.id)), s) for s in songs)
+        else:
+            entries = sorted(((s.title.casefold(), s.artist.casefold(), str(s.id)), s) for s in songs)
 
-            for file_name in os.listdir(tempdir):
-                source = os.path.join(tempdir, file_name)
-                destination = os.path.join(directory, file_name)
-                shutil.move(source, destination)
+        keys = [key for key, _ in entries]
+        songs = [song for _, song in entries]
 
-        return cls(directory, title, artist, id, "cover.jpg", "song.mp3", source="local")
+        with cls._songs_lock:
+            cls._sorted_cache[sort] = (version, keys, songs)
+
+        return keys, songs
 
     @classmethod
-    def song_list(cls) -> List[dict]:
-        return [s.to_json() for s in cls.songs.values()]
+    def page(cls, sort: str = "title", descending: bool = False, cursor: Optional[tuple] = None, limit: int = 50, query: Optional[str] = None) -> Tuple[List['Song'], Optional[tuple], int]:
+        """
+        Returns one page of the sorted song list.
+
+        The cursor is the sort key of the last song of the previous page, so pages stay consistent when songs are
+        added or removed while a client is scrolling.
+
+        :param sort: 'title' or 'artist'
+        :param descending: Sort in descending order
+        :param cursor: The cursor returned with the previous page or None for the first page
+        :param limit: The maximum number of songs
+        :param query: Only return songs whose title or artist contain this text
+        :return: A tuple of the songs, the cursor for the next page (None on the last page) and the number of matching songs
+        """
+
+        keys, songs = cls.sorted_songs(sort)
+
+        if query:
+            query = query.casefold()
+            matches = [i for i, key in enumerate(keys) if query in key[0] or query in key[1]]
+            keys = [keys[i] for i in matches]
+            songs = [songs[i] for i in matches]
+
+        if descending:
+            end = len(keys) if cursor is None else bisect.bisect_left(keys, cursor)
+            start = max(0, end - limit)
+            selected = songs[start:end][::-1]
+            next_cursor = keys[start] if start > 0 else None
+        else:
+            start = 0 if cursor is None else bisect.bisect_right(keys, cursor)
+            end = start + limit
+            selected = songs[start:end]
+            next_cursor = keys[end - 1] if end < len(keys) else None
+
+        return selected, next_cursor, len(keys)
 
     @classmethod
-    def get_song_by_id(cls, id) -> 'Song':
+    def search(cls, query: str, limit: int = 50) -> List['Song']:
         """
-        Get a song by ID, checking both local and network paths
+        Searches the titles and artists of all songs
+
+        :param query: The search text, accents, case and single typos are ignored
+        :param limit: The maximum number of results
+        :return: The matching songs, best matches first
         """
-        # First try to get from local path
-        song = cls.songs.get(str(id))
-        if song:
+
+        results = cls.search_index.search(query, limit)
+        return [song for song in (cls.songs.get(song_id) for song_id, _ in results) if song is not None]
+
+    @classmethod
+    def remove_directory(cls, directory) -> Optional['Song']:
+        """
+        Removes the song in the given directory from the library
+
+        :param directory: The song directory
+        :return: The removed song or None if there was no song in the directory
+        """
+
+        with cls._songs_lock:
+            song = cls.directories.pop(str(directory), None)
+            if song is None:
+                return None
+
+            remaining = ()
+            if song.usdb_id is not None:
+                remaining = tuple(s for s in cls.by_usdb_id.get(song.usdb_id, ()) if s is not song)
+                if remaining:
+                    cls.by_usdb_id[song.usdb_id] = remaining
+                else:
+                    cls.by_usdb_id.pop(song.usdb_id, None)
+
+            if cls.songs.get(str(song.id)) is song:
+                del cls.songs[str(song.id)]
+                cls.search_index.remove(str(song.id))
+
+                # another copy of the song (e.g. the local one if the network copy was removed) takes its place
+                if remaining:
+                    other = remaining[-1]
+                    cls.songs[str(other.id)] = other
+                    cls.search_index.add(str(other.id), other.title, other.artist)
+            Song.version += 1
+
+            if song.usdb_id is not None and cls.network_usdb_dirs.get(str(song.usdb_id)) == str(directory):
+                del cls.network_usdb_dirs[str(song.usdb_id)]
+
+        return song
+
+    @classmethod
+    def reload_directory(cls, directory, source: str = "local") -> Optional[Tuple[str, 'Song']]:
+        """
+        Brings the library and the song index up to date for a single song directory that changed on disk
+
+        :param directory: The song directory
+        :param source: 'local' or 'net'
+        :return: A tuple of the action ('added', 'updated' or 'removed') and the affected song or None if nothing changed
+        """
+
+        directory = str(directory)
+        old_song = cls.remove_directory(directory)
+        entry = cls._process_song_directory(directory, source)
+
+        if cls.index is not None:
+            try:
+                if entry is not None:
+                    cls.index.put([entry])
+                else:
+                    cls.index.remove([directory])
+            except Exception as e:
+                logging.error(f"Could not update the song index for {directory}: {e}")
+
+        # after the index was written, so the duration is not overwritten by the entry without it
+        cls.probe_durations()
+
+        new_song = cls.directories.get(directory)
+
+        if new_song is not None:
+            return ("updated" if old_song is not None else "added"), new_song
+        elif old_song is not None:
+            return "removed", old_song
+        else:
+            return None
+
+    @classmethod
+    def get_song_by_id(cls, id) -> Optional['Song']:
+        """
+        Get a song by ID without touching the songs directories.
+
+        If the id belongs to a known directory in the network songs directory that could not be loaded (e.g. because it
+        was still being copied during the scan), the directory is reloaded in the background. Misses are remembered for
+        a while so repeated lookups of unknown ids are answered from memory.
+
+        :param id: The song id (usdb id or the generated id of songs without usdb id)
+        :return: The song or None if it is not (yet) known
+        """
+
+        id = str(id)
+
+        song = cls.songs.get(id)
+        if song is not None:
             return song
 
-        # If not found, check network path
-        network_songs_dir = config.network_songs_dir if hasattr(config, 'network_songs_dir') else None
+        with cls._songs_lock:
+            now = time.monotonic()
+            while cls._missing_ids and now - next(iter(cls._missing_ids.values())) >= cls.MISSING_ID_TTL:
+                cls._missing_ids.popitem(last=False)
+
+            if id in cls._missing_ids:
+                return None
+
+            cls._missing_ids[id] = now
+            if len(cls._missing_ids) > cls.MAX_MISSING_IDS:
+                cls._missing_ids.popitem(last=False)
+            directory = cls.network_usdb_dirs.get(id)
+
+        if directory is not None:
+            logging.info(f"Song {id} is not loaded yet, reloading '{directory}' in the background")
+            threading.Thread(target=cls.reload_directory, args=(directory, "net"), daemon=True).start()
+
+        return None
+
+    @classmethod
+    def forget_missing_ids(cls):
+        """
+        Forgets the ids that were not found, e.g. because new songs appeared in a songs directory
+        """
+
+        with cls._songs_lock:
+            cls._missing_ids.clear()
+
+    @classmethod
+    def probe_durations(cls):
+        """
+        Determines the durations of all songs that do not know theirs yet (e.g. new songs that are not in the song
+        index) in the background and stores them in the song index
+        """
+
+        with cls._songs_lock:
+            songs = [song for song in cls.directories.values() if song._duration is None and not song._duration_probed]
+            for song in songs:
+                song._duration_probed = True
+
+        if not songs:
+            return
+
+        def run():
+            found = 0
+            # in batches, so the song list is not rebuilt for every song and the index is written in few transactions
+            for start in range(0, len(songs), 200):
+                durations = list(cls._duration_executor.map(Song._probe_duration, songs[start:start + 200]))
+                found += sum(1 for _, duration, _ in durations if duration != UNKNOWN_DURATION)
+
+                with cls._songs_lock:
+                    Song.version += 1
+
+                cls._store_durations(durations)
+
+            logging.info(f"Determined the durations of {found} of {len(songs)} songs")
+
+        threading.Thread(target=run, name="duration-probe", daemon=True).start()
+
+    @classmethod
+    def _store_durations(cls, durations: List[Tuple[str, float, Optional[int]]]):
+        if cls.index is None or not durations:
+            return
+
         try:
-            for subdir in os.listdir(network_songs_dir):
-                subdir_path = os.path.join(network_songs_dir, subdir)
-                if os.path.isdir(subdir_path):
-                    try:
-                        usdb_id = None
-                        if os.path.isfile(os.path.join(subdir_path, "usdb_data.json")):
-                            with open(os.path.join(subdir_path, "usdb_data.json")) as file:
-                                usdb_data = json.loads(file.read())
-                                usdb_id = usdb_data.get("id")
-
-                        if str(usdb_id) == str(id):
-                            txt_files = [f for f in os.listdir(subdir_path) if f.endswith('.txt')]
-                            if txt_files:
-                                txt_path = os.path.join(subdir_path, txt_files[0])
-                                with open(txt_path, 'r') as file:
-                                    txt = file.read()
-
-                                    match = re.search(r'#TITLE:(.*)\n', txt)
-                                    if match:
-                                        title = match.group(1)
-                                    else:
-                                        logging.warning(f"No title for {subdir_path}")
-                                        return None
-
-                                    match = re.search(r'#ARTIST:(.*)\n', txt)
-                                    if match:
-                                        artist = match.group(1)
-                                    else:
-                                        logging.warning(f"No artist for {subdir_path}")
-                                        return None
-
-                                    match = re.search(r'#COVER:(.*)\n', txt)
-                                    cover = None
-                                    if match:
-                                        cover = match.group(1)
-
-                                    match = re.search(r'#MP3:(.*)\n', txt)
-                                    mp3 = None
-                                    if match:
-                                        mp3 = match.group(1)
-
-                                    return cls(subdir_path, title, artist, usdb_id, cover, mp3, source="net")
-                    except Exception as e:
-                        logging.error(f"Error processing network song {subdir_path}: {e}")
+            cls.index.set_durations(durations)
         except Exception as e:
-            logging.error(f"Error accessing network path: {e}")
+            logging.error(f"Could not store the song durations in the song index: {e}")
 
-        return None
+    def _probe_duration(self) -> Tuple[str, float, Optional[int]]:
+        """
+        Reads the duration from the headers of the audio file (blocking)
 
-    @staticmethod
-    def get_mp3_length(filename):
-        audiofile = eyed3.load(filename)
-        duration = audiofile.info.time_secs
-        return duration
+        :return: The entry for SongIndex.set_durations, with UNKNOWN_DURATION if the file could not be read
+        """
+
+        # before reading, so a file that is replaced meanwhile is read again on the next start
+        audio_mtime = _mtime(self.directory, self.mp3)
 
-    def __init__(self, directory: str, title: str, artist: str, usdb_id: Optional[str] = None, cover: Optional[str] = None, mp3: Optional[str] = None, source: str = "local"):
+        duration = audio_probe.probe_duration(os.path.join(self.directory, self.mp3)) if self.mp3 else None
+        if duration is None:
+            return self.directory, UNKNOWN_DURATION, audio_mtime
+
+        self._duration = duration
+        return self.directory, duration, audio_mtime
+
+    def _probe_and_store_duration(self):
+        entry = self._probe_duration()
+        if entry[1] != UNKNOWN_DURATION:
+            with self._songs_lock:
+                Song.version += 1
+        self._store_durations([entry])
+
+    @property
+    def duration(self) -> Optional[float]:
+        """
+        The duration of the audio file in seconds, None while it is not known
+
+        Reading the audio file is never done by the caller, the first access of an unknown duration only schedules it
+        in the background.
+        """
+
+        if self._duration is None and not self._duration_probed:
+            self._duration_probed = True
+            self._duration_executor.submit(self._probe_and_store_duration)
+        return self._duration
+
+    def __init__(self, directory: str, title: str, artist: str, usdb_id: Optional[str] = None, cover: Optional[str] = None, mp3: Optional[str] = None, source: str = "local", duration: Optional[float] = None):
         """
         Creates a new song from the information found in the directory
 
@@ -335,27 +1096,44 @@ class Song:
         :param title: The song title
         :param artist: The artist
         :param usdb_id: An optional ID of the song on usdb.animux.de/
+        :param duration: The duration of the mp3 if already known (e.g. from the song index), otherwise it is determined
+            in the background (see Song.duration)
         """
 
-        self.directory = directory
+        # the same string object is the key in Song.directories, so the path is stored only once
+        self.directory = str(directory)
         self.title = title
-        self.artist = artist
+        self.artist = sys.intern(artist)
         self.usdb_id = usdb_id
-        self.cover = cover
-        self.mp3 = mp3
-        self.duration = self.get_mp3_length(os.path.join(directory, mp3))
-        self.source = source  # Can be 'local' or 'net'
-
-        if cover:
-            self.cover_path = os.path.join(directory, cover)
-        else:
-            self.cover_path = None
-
-        self.id = usdb_id or uuid.uuid4().hex
-        self.songs[str(self.id)] = self
+        # relative to the song directory and mostly the same for all songs (e.g. 'cover.jpg')
+        self.cover = sys.intern(cover) if cover else None
+        self.mp3 = sys.intern(mp3) if mp3 else None
+        self._duration = duration if duration != UNKNOWN_DURATION else None
+        # the audio file could not be read last time and did not change since
+        self._duration_probed = duration == UNKNOWN_DURATION
+        self.source = sys.intern(source)  # Can be 'local' or 'net'
+
+        # songs without usdb id get an id derived from the directory, so it stays the same when the song is reloaded
+        self.id = usdb_id or uuid.uuid5(uuid.NAMESPACE_URL, self.directory).hex
+        with self._songs_lock:
+            self.songs[str(self.id)] = self
+            self.directories[self.directory] = self
+            self.search_index.add(str(self.id), title, artist)
+            Song.version += 1
+            self._missing_ids.pop(str(self.id), None)
+
+            if usdb_id is not None:
+                self.by_usdb_id[usdb_id] = self.by_usdb_id.get(usdb_id, ()) + (self,)
+
+    @property
+    def cover_path(self) -> Optional[str]:
+        """
+        The absolute path of the cover or None if the song has no cover
+        """
 
-        if usdb_id is not None:
-            self.usdb_ids.add(usdb_id)
+        if not self.cover:
+            return None
+        return os.path.join(self.directory, self.cover)
 
     def __str__(self):
         if self.usdb_id is not None:
@@ -367,6 +1145,13 @@ class Song:
             return f"[Song '{self.title} - {self.artist}' ({self.usdb_id})]"
         return f"[Song '{self.title} - {self.artist}']"
 
+    def to_row(self) -> list:
+        """
+        Returns the song as a list of the values of Song.ROW_FIELDS for compact API responses
+        """
+
+        return [self.id, self.title, self.artist, self.usdb_id, self.duration, self.source]
+
     def to_json(self):
         return {
             "directory": self.directory,
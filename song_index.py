@@ -0,0 +1,133 @@
+import logging
+import sqlite3
+import threading
+from typing import Dict, Iterable, List, Optional, Tuple
+
+# stored as duration of songs whose audio file could not be read, so it is only read again once it changes
+UNKNOWN_DURATION = -1
+
+_FIELDS = ["directory", "root", "dir_mtime", "txt_file", "txt_mtime", "title", "artist", "cover", "mp3", "usdb_id", "duration", "encoding", "audio_mtime"]
+
+
+class SongIndex:
+    """
+    Persistent index of the parsed song directories
+
+    Every song directory is stored with the modification times of the directory and its txt file, so a scan only
+    has to parse directories that changed since the last start.
+    """
+
+    def __init__(self, file_name: str):
+        """
+        Opens (and if needed creates) the index
+
+        :param file_name: The path to the sqlite database
+        """
+
+        self.file_name = file_name
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(file_name, check_same_thread=False)
+        self._connection.execute("""
+            CREATE TABLE IF NOT EXISTS songs (
+                directory TEXT PRIMARY KEY,
+                root TEXT NOT NULL,
+                dir_mtime INTEGER NOT NULL,
+                txt_file TEXT NOT NULL,
+                txt_mtime INTEGER NOT NULL,
+                title TEXT NOT NULL,
+                artist TEXT NOT NULL,
+                cover TEXT,
+                mp3 TEXT,
+                usdb_id INTEGER,
+                duration REAL,
+                encoding TEXT,
+                audio_mtime INTEGER
+            )
+        """)
+
+        # indexes created by older versions
+        columns = [row[1] for row in self._connection.execute("PRAGMA table_info(songs)")]
+        if "audio_mtime" not in columns:
+            self._connection.execute("ALTER TABLE songs ADD COLUMN audio_mtime INTEGER")
+
+        self._connection.commit()
+
+    def load(self) -> Dict[str, dict]:
+        """
+        Reads the whole index
+
+        :return: A dict mapping the song directories to their index entries
+        """
+
+        with self._lock:
+            rows = self._connection.execute(f"SELECT {', '.join(_FIELDS)} FROM songs").fetchall()
+
+        return {row[0]: dict(zip(_FIELDS, row)) for row in rows}
+
+    def put(self, entries: Iterable[dict]):
+        """
+        Adds or replaces entries in the index
+
+        :param entries: The entries to store, each containing all index fields
+        """
+
+        rows = [tuple(entry[field] for field in _FIELDS) for entry in entries]
+        if not rows:
+            return
+
+        with self._lock:
+            with self._connection:
+                self._connection.executemany(f"INSERT OR REPLACE INTO songs ({', '.join(_FIELDS)}) VALUES ({', '.join('?' * len(_FIELDS))})", rows)
+
+    def set_durations(self, durations: Iterable[Tuple[str, float, Optional[int]]]):
+        """
+        Stores the durations of songs that were determined after the songs were added to the index
+
+        :param durations: Tuples of the song directory, the duration in seconds (or UNKNOWN_DURATION) and the
+            modification time of the audio file when it was read
+        """
+
+        rows = [(duration, audio_mtime, directory) for directory, duration, audio_mtime in durations]
+        if not rows:
+            return
+
+        with self._lock:
+            with self._connection:
+                self._connection.executemany("UPDATE songs SET duration = ?, audio_mtime = ? WHERE directory = ?", rows)
+
+    def remove(self, directories: Iterable[str]):
+        """
+        Removes entries from the index
+
+        :param directories: The song directories to remove
+        """
+
+        rows = [(directory,) for directory in directories]
+        if not rows:
+            return
+
+        with self._lock:
+            with self._connection:
+                self._connection.executemany("DELETE FROM songs WHERE directory = ?", rows)
+
+    def prune(self, root: str, directories: Iterable[str]) -> List[str]:
+        """
+        Removes all entries of a songs root that are not in the given directories
+
+        :param root: The songs root
+        :param directories: The song directories that still exist in the root
+        :return: The removed directories
+        """
+
+        existing = set(directories)
+
+        with self._lock:
+            stored = [row[0] for row in self._connection.execute("SELECT directory FROM songs WHERE root = ?", (root,))]
+
+        removed = [directory for directory in stored if directory not in existing]
+        self.remove(removed)
+
+        if removed:
+            logging.info(f"Removed {len(removed)} songs from the index that no longer exist in {root}")
+
+        return removed
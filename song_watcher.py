@@ -0,0 +1,209 @@
+import logging
+import os
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+
+from song import Song
+
+try:
+    from watchdog.events import FileSystemEventHandler
+    from watchdog.observers import Observer
+except ImportError:
+    FileSystemEventHandler = object
+    Observer = None
+
+_CHANGE_EVENTS = {"created", "deleted", "modified", "moved"}
+
+
+class _SongDirectoryHandler(FileSystemEventHandler):
+    """
+    Translates file system events into the song directories that need to be reloaded
+    """
+
+    def __init__(self, watcher: 'SongWatcher', root: str, source: str):
+        super().__init__()
+        self.watcher = watcher
+        self.root = root
+        self.source = source
+
+    def on_any_event(self, event):
+        # reading the files of a song (e.g. while reloading it) must not count as a change
+        if event.event_type not in _CHANGE_EVENTS:
+            return
+
+        for path in (event.src_path, getattr(event, "dest_path", None)):
+            if not path:
+                continue
+
+            relative = os.path.relpath(path, self.root)
+            if relative == "." or relative.startswith(".."):
+                continue
+
+            self.watcher.mark_dirty(os.path.join(self.root, relative.split(os.sep)[0]), self.source)
+
+
+class SongWatcher:
+    """
+    Keeps Song.songs up to date with the songs directories after the initial scan.
+
+    Local directories are watched with native file system notifications (inotify, FSEvents, ...) if watchdog is
+    installed. Network directories (and local directories without watchdog) are polled by comparing the modification
+    times of the song directories. Changed directories are reloaded once no further changes happened for a short time,
+    so songs that are still being copied are not parsed over and over again.
+    """
+
+    def __init__(self, on_change: Callable[[str, Song], None], poll_interval: float = 30, settle_time: float = 2):
+        """
+        :param on_change: Called with the action ('added', 'updated' or 'removed') and the song for every change
+        :param poll_interval: Seconds between two polls of directories that can not be watched natively
+        :param settle_time: Seconds without changes before a directory is reloaded
+        """
+
+        self.on_change = on_change
+        self.poll_interval = poll_interval
+        self.settle_time = settle_time
+
+        self._roots: List[Tuple[str, str, bool]] = []
+        self._dirty: Dict[str, Tuple[str, float]] = {}
+        self._dirty_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopped = threading.Event()
+        self._observer = None
+
+    def add_root(self, songs_dir, source: str, native: bool = True):
+        """
+        Adds a songs directory to watch
+
+        :param songs_dir: The songs directory
+        :param source: 'local' or 'net'
+        :param native: Use native file system notifications if available, otherwise the directory is polled
+        """
+
+        if songs_dir is None or not os.path.isdir(songs_dir):
+            logging.warning(f"Not watching {source} songs directory '{songs_dir}' since it does not exist")
+            return
+
+        self._roots.append((str(songs_dir), source, native and Observer is not None))
+
+    def start(self):
+        """
+        Starts watching all added roots in background threads
+        """
+
+        # first, so changes found by any of the watchers below are processed
+        threading.Thread(target=self._process_dirty, name="watch-reload", daemon=True).start()
+
+        native_roots = []
+        for root, source, native in self._roots:
+            if native:
+                native_roots.append((root, source))
+            else:
+                self._start_polling(root, source)
+
+        if not native_roots:
+            return
+
+        try:
+            self._observer = Observer()
+            self._observer.daemon = True
+            for root, source in native_roots:
+                self._observer.schedule(_SongDirectoryHandler(self, root, source), root, recursive=True)
+            self._observer.start()
+        except OSError as e:
+            # e.g. the inotify watch limit is reached on large libraries
+            logging.warning(f"Could not watch the songs directories natively, polling them instead: {e}")
+            try:
+                self._observer.stop()
+            except Exception:
+                pass
+            self._observer = None
+
+            for root, source in native_roots:
+                self._start_polling(root, source)
+            return
+
+        for root, source in native_roots:
+            logging.info(f"Watching {source} songs in {root}")
+
+    def _start_polling(self, root: str, source: str):
+        threading.Thread(target=self._poll, args=(root, source), name=f"watch-{source}", daemon=True).start()
+        logging.info(f"Polling {source} songs in {root} every {self.poll_interval} seconds")
+
+    def stop(self):
+        """
+        Stops all watchers
+        """
+
+        self._stopped.set()
+        self._wakeup.set()
+
+        if self._observer is not None:
+            self._observer.stop()
+
+    def mark_dirty(self, directory: str, source: str):
+        """
+        Schedules a song directory to be reloaded
+
+        :param directory: The song directory
+        :param source: 'local' or 'net'
+        """
+
+        with self._dirty_lock:
+            self._dirty[directory] = (source, time.monotonic())
+        self._wakeup.set()
+
+    def _snapshot(self, root: str) -> Optional[Dict[str, int]]:
+        try:
+            with os.scandir(root) as entries:
+                return {entry.path: entry.stat().st_mtime_ns for entry in entries if entry.is_dir()}
+        except OSError as e:
+            logging.error(f"Could not poll songs directory '{root}': {e}")
+            return None
+
+    def _poll(self, root: str, source: str):
+        last = self._snapshot(root) or {}
+
+        while not self._stopped.wait(self.poll_interval):
+            current = self._snapshot(root)
+            if current is None:
+                continue
+
+            changed = [directory for directory in last.keys() | current.keys() if last.get(directory) != current.get(directory)]
+            if changed:
+                # songs that were not found before might be there now
+                Song.forget_missing_ids()
+
+            for directory in changed:
+                self.mark_dirty(directory, source)
+
+            last = current
+
+    def _process_dirty(self):
+        while not self._stopped.is_set():
+            self._wakeup.wait(self.settle_time)
+            self._wakeup.clear()
+
+            now = time.monotonic()
+            with self._dirty_lock:
+                ready = [(directory, source) for directory, (source, changed) in self._dirty.items() if now - changed >= self.settle_time]
+                for directory, _ in ready:
+                    del self._dirty[directory]
+
+            for directory, source in ready:
+                try:
+                    change = Song.reload_directory(directory, source)
+                except Exception as e:
+                    logging.exception(f"Could not reload song directory '{directory}': {e}")
+                    continue
+
+                if change is None:
+                    continue
+
+                action, song = change
+                logging.info(f"Song {action}: {song}")
+
+                try:
+                    self.on_change(action, song)
+                except Exception as e:
+                    logging.exception(f"Error while handling song change for '{directory}': {e}")
@@ -1,14 +1,55 @@
-window.addEventListener("DOMContentLoaded", () => {
-    const websocket = new WebSocket(`ws://${window.location.hostname}:5678/`);
+let lastSeq = null; // sequence number of the last message received from the websocket
+let epoch = null; // identifies the run of the server that lastSeq belongs to
+let websocket = null;
+const topics = new Set(["log"]); // the console is on every page
+
+// receive the messages of further topics ("downloads", "library", "players"), pages call this for what they show
+function subscribe(...newTopics) {
+    newTopics.forEach(topic => topics.add(topic));
+    if (websocket !== null && websocket.readyState === WebSocket.OPEN) {
+        websocket.send(JSON.stringify({type: "subscribe", topics: newTopics}));
+    }
+}
+
+function connectWebsocket() {
+    websocket = new WebSocket(`ws://${window.location.hostname}:5678/`);
+    websocket.onopen = () => {
+        // only get the messages that were missed while disconnected
+        websocket.send(JSON.stringify({type: "resume", seq: lastSeq, epoch: epoch, topics: [...topics]}));
+    };
     websocket.onmessage = ({data}) => {
         let msg = JSON.parse(data);
-        if (msg.source) {
-            msg.msg += ` (${msg.source})`;
+        if (msg.type === "history") {
+            // the server was restarted, its sequence numbers started again
+            if (msg.reset || msg.epoch !== epoch) lastSeq = null;
+            epoch = msg.epoch;
+            // on a new page only the console is filled, the page loaded its current state itself
+            msg.messages.forEach(message => handleMessage(message, msg.resumed));
+            return;
         }
-        addConsoleMessage(msg.msg, msg.type === "error");
+        handleMessage(msg, true);
+    };
+    websocket.onclose = () => {
+        setTimeout(connectWebsocket, 2000);
     };
+}
 
-});
+function handleMessage(msg, live) {
+    if (lastSeq !== null && msg.seq <= lastSeq) return;
+    lastSeq = msg.seq;
+
+    // let the individual pages react to the message
+    if (live) {
+        document.dispatchEvent(new CustomEvent(`wingman:${msg.type}`, {detail: msg}));
+    }
+    if (msg.msg === undefined) return;
+    if (msg.source) {
+        msg.msg += ` (${msg.source})`;
+    }
+    addConsoleMessage(msg.msg, msg.type === "error", live);
+}
+
+window.addEventListener("DOMContentLoaded", connectWebsocket);
 
 function restart() {
     if (confirm('Are you sure you want to restart UltraStar Deluxe? Be aware that you will be punched if you interrupt a song.')) {
@@ -37,9 +78,14 @@ function download(id) {
             id: id
         }),
         success: function (response) {
-            console.log(`Added ${id} to download queue`)
+            console.log(response.queued ? `Added ${id} to download queue` : `${id} is already in the download queue`)
         },
         error: function (xhr, textStatus, errorThrown) {
+            if (xhr.status === 409) {
+                // somebody else was faster
+                document.dispatchEvent(new CustomEvent("wingman:download", {detail: {id: id, state: "finished"}}));
+                return;
+            }
             console.error("Error while downloading:", xhr.responseText);
             // alert(`Error while downloading: ${textStatus} (${xhr.status}) ${errorThrown} ${xhr.responseText}`);
             alert(`Error while downloading  (${xhr.status}): ${xhr.responseText}`);
@@ -71,7 +117,7 @@ function showPopupMessage(msg) {
     }, 5000);
 }
 
-function addConsoleMessage(message, error = false) {
+function addConsoleMessage(message, error = false, popup = error) {
     const consoleDiv = document.getElementById('console-content');
     const messageLabel = document.createElement('label');
     messageLabel.textContent = message;
@@ -83,7 +129,7 @@ function addConsoleMessage(message, error = false) {
     // Scroll to the bottom
     consoleDiv.scrollTop = consoleDiv.scrollHeight;
 
-    if (error) {
+    if (error && popup) {
         showPopupMessage(message);
     }
 }
\ No newline at end of file
@@ -2,6 +2,8 @@ let currentPage = 1; // Track the current page
 let finished = false; // Track if the list has ended
 let isLoading = false; // Flag to prevent multiple concurrent loads
 
+subscribe("downloads");
+
 function search(reset = false) {
     if (reset) {
         currentPage = 1;
@@ -40,7 +42,7 @@ function search(reset = false) {
             data.songs.forEach(song => {
                 $('#songs').append(
                     // TODO: different eye
-                    $(`<div class="song" id="${song.id}"><span class="cover" style="background-image: url('https://usdb.animux.de/data/cover/${song.id}.jpg');"></span><label class="title">${song.title}</label><label class="artist">${song.artist}</label><label class="stats">${song.rating} <i class="star"></i> | ${song.views} <i class="eye"></i></label></div>`)
+                    $(`<div class="song" id="${song.id}"><span class="cover" style="background-image: url('/api/usdb/cover/${song.id}?size=256');"></span><label class="title">${song.title}</label><label class="artist">${song.artist}</label><label class="stats">${song.rating} <i class="star"></i> | ${song.views} <i class="eye"></i></label></div>`)
                         .on("click", () => {
                             let element = $("#" + song.id);
                             if (!(element.hasClass("queued") || element.hasClass("downloading") || element.hasClass("downloaded"))) {
@@ -74,4 +76,30 @@ $(document).ready(function () {
             search(); // Load new songs
         }
     });
-});
\ No newline at end of file
+});
+
+document.addEventListener("wingman:download", ({detail}) => {
+    let element = $("#" + detail.id);
+    element.removeClass("queued downloading downloaded");
+    element.find(".cover").removeAttr("data-progress");
+
+    if (detail.state === "queued") {
+        element.addClass("queued");
+    } else if (detail.state === "started") {
+        element.addClass("downloading");
+    } else if (detail.state === "finished") {
+        element.addClass("downloaded");
+    }
+});
+
+document.addEventListener("wingman:progress", ({detail}) => {
+    let element = $("#" + detail.id);
+    if (!element.hasClass("downloading")) return;
+
+    // e.g. "MEDIA 42%"
+    let text = detail.stage.toUpperCase();
+    if (detail.percent !== undefined) {
+        text += ` ${Math.floor(detail.percent)}%`;
+    }
+    element.find(".cover").attr("data-progress", text);
+});
@@ -1,3 +1,5 @@
+subscribe("players");
+
 $(function () {
     $(".area").droppable({
         accept: ".player",
@@ -99,5 +101,15 @@ $(function () {
         }
     });
 
+    // players added or removed on another phone
+    document.addEventListener("wingman:players", ({detail}) => {
+        const existing = $(".player").filter((_, element) => element.firstChild.textContent === detail.name);
+        if (detail.action === "added" && existing.length === 0) {
+            addPlayer(detail.name);
+        } else if (detail.action === "removed") {
+            existing.remove();
+        }
+    });
+
     getPlayers();
 });
\ No newline at end of file
@@ -1,23 +1,101 @@
-function searchTable() {
-    let input, filter, list, div, label, i, j, txtValue;
-    input = document.getElementById("searchInput");
-    filter = input.value.toUpperCase();
-    list = document.getElementById("songs");
-    div = list.getElementsByTagName("div");
-
-    for (i = 0; i < div.length; i++) {
-        console.log(div[i]);
-        div[i].style.display = "none";
-        label = div[i].getElementsByTagName("label");
-        for (j = 0; j < label.length; j++) {
-            if (label[j]) {
-                txtValue = label[j].textContent || label[j].innerText;
-                if (txtValue.toUpperCase().indexOf(filter) > -1) {
-                    console.log(div[i]);
-                    div[i].style.display = "";
-                    break;
-                }
+let nextCursor = null; // Cursor for the next page, null if the list is complete
+let finished = false; // Track if the list has ended
+let isLoading = false; // Flag to prevent multiple concurrent loads
+let query = ""; // The current search text
+let searchTimeout = null;
+
+subscribe("library");
+
+function loadSongs(reset = false) {
+    if (reset) {
+        nextCursor = null;
+        finished = false;
+        $('#songs').empty();
+    }
+
+    if (finished || isLoading) return;
+    isLoading = true;
+
+    let requestedQuery = query;
+
+    // searches are ranked on the server and not paginated
+    $.ajax({
+        url: requestedQuery ? '/api/songs/search' : '/api/songs',
+        type: 'GET',
+        data: requestedQuery ? {
+            q: requestedQuery,
+            limit: 100
+        } : {
+            cursor: nextCursor || undefined,
+            limit: 50
+        },
+        success: function (data) {
+            // a newer search was started while loading
+            if (requestedQuery !== query) return;
+
+            data.songs.forEach(row => {
+                let song = {};
+                data.fields.forEach((field, i) => song[field] = row[i]);
+                $('#songs').append(createSongElement(song));
+            });
+
+            nextCursor = data.next || null;
+            finished = !data.next;
+        },
+        error: function (jqXHR, textStatus, errorThrown) {
+            console.error('Error fetching songs: ' + textStatus, errorThrown);
+        },
+        complete: function () {
+            isLoading = false;
+
+            if (requestedQuery !== query) {
+                loadSongs(true);
+            } else {
+                loadIfVisible();
             }
         }
+    });
+}
+
+function searchSongs() {
+    clearTimeout(searchTimeout);
+    searchTimeout = setTimeout(() => {
+        query = document.getElementById("searchInput").value.trim();
+        loadSongs(true);
+    }, 200);
+}
+
+function loadIfVisible() {
+    // load the next page as long as the end of the list is visible
+    let main = $("main")[0];
+    if (main.scrollTop + main.clientHeight >= $("#songs-end")[0].offsetTop - main.clientHeight) {
+        loadSongs();
+    }
+}
+
+function createSongElement(song) {
+    let element = $('<div class="song"><span class="cover"></span><label class="title"></label><label class="artist"></label></div>');
+    element.attr("data-id", song.id);
+    element.find(".cover").css("background-image", `url('/song/${song.id}/cover?size=128')`);
+    element.find(".title").text(song.title);
+    element.find(".artist").text(song.artist);
+    return element;
+}
+
+document.addEventListener("wingman:library", ({detail}) => {
+    let existing = $("#songs .song").filter((i, element) => element.dataset.id === String(detail.song.id));
+
+    if (detail.action === "removed") {
+        existing.remove();
+    } else if (existing.length) {
+        existing.replaceWith(createSongElement(detail.song));
+    } else if (finished && query === "") {
+        // songs that are not loaded yet will show up on their page
+        $("#songs").append(createSongElement(detail.song));
     }
-}
\ No newline at end of file
+});
+
+$(document).ready(function () {
+    $("main").scroll(loadIfVisible);
+    loadSongs();
+});
@@ -0,0 +1,143 @@
+import hashlib
+import logging
+import os
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Dict, Tuple
+
+from PIL import Image
+
+import config
+
+SIZES = (128, 256, 512)
+FORMATS = {
+    "webp": "image/webp",
+    "jpeg": "image/jpeg"
+}
+
+_executor = ThreadPoolExecutor(max_workers=config.thumbnail_workers, thread_name_prefix="thumbnail")
+_lock = threading.Lock()
+_digests: Dict[Tuple[str, int, int], str] = {}
+_pending: Dict[Tuple[str, int, str], Future] = {}
+
+
+def fit_size(requested: int) -> int:
+    """
+    Returns the smallest of the fixed thumbnail sizes that is at least as large as the requested size
+
+    :param requested: The requested edge length in pixels
+    :return: One of SIZES
+    """
+
+    for size in SIZES:
+        if size >= requested:
+            return size
+    return SIZES[-1]
+
+
+def _cache_path(digest: str, size: int, fmt: str) -> str:
+    # spread the files over subdirectories to keep the directories small on large libraries
+    return os.path.join(config.thumbnail_cache_dir, digest[:2], f"{digest}_{size}.{fmt}")
+
+
+def _digest(source: str, source_stat: os.stat_result) -> str:
+    key = (source, source_stat.st_mtime_ns, source_stat.st_size)
+
+    with _lock:
+        digest = _digests.get(key)
+    if digest is not None:
+        return digest
+
+    sha1 = hashlib.sha1()
+    with open(source, "rb") as file:
+        for chunk in iter(lambda: file.read(65536), b""):
+            sha1.update(chunk)
+    digest = sha1.hexdigest()
+
+    with _lock:
+        _digests[key] = digest
+
+    return digest
+
+
+def _render(source: str, source_stat: os.stat_result, size: int, fmt: str) -> Tuple[str, str]:
+    digest = _digest(source, source_stat)
+    target = _cache_path(digest, size, fmt)
+
+    if not os.path.isfile(target):
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+
+        with Image.open(source) as image:
+            image = image.convert("RGB")
+            image.thumbnail((size, size), Image.LANCZOS)
+
+            temp = f"{target}.{threading.get_ident()}.tmp"
+            if fmt == "webp":
+                image.save(temp, "WEBP", quality=80, method=4)
+            else:
+                image.save(temp, "JPEG", quality=85, optimize=True, progressive=True)
+            os.replace(temp, target)
+
+        logging.debug(f"Created {size}px {fmt} thumbnail for '{source}'")
+
+    return target, digest
+
+
+def get_thumbnail(source: str, size: int, fmt: str = "jpeg") -> Future:
+    """
+    Returns the thumbnail of an image, creating it in the background pool if it is not cached yet.
+
+    Thumbnails are stored by the hash of the source image, so identical covers share their thumbnails and a changed
+    cover automatically gets new ones.
+
+    :param source: The path to the original image
+    :param size: The maximum edge length, should be one of SIZES
+    :param fmt: 'webp' or 'jpeg'
+    :return: A future resolving to a tuple of the path of the thumbnail and the hash of the source image
+    """
+
+    source_stat = os.stat(source)
+
+    with _lock:
+        digest = _digests.get((source, source_stat.st_mtime_ns, source_stat.st_size))
+
+    # fast path without the pool if the thumbnail exists
+    if digest is not None:
+        target = _cache_path(digest, size, fmt)
+        if os.path.isfile(target):
+            future = Future()
+            future.set_result((target, digest))
+            return future
+
+    key = (source, size, fmt)
+    with _lock:
+        future = _pending.get(key)
+        created = future is None
+        if created:
+            future = _executor.submit(_render, source, source_stat, size, fmt)
+            _pending[key] = future
+
+    if created:
+        future.add_done_callback(lambda f: _forget(key, f))
+
+    return future
+
+
+def _forget(key: Tuple[str, int, str], future: Future):
+    with _lock:
+        if _pending.get(key) is future:
+            del _pending[key]
+
+
+def etag(digest: str, size: int, fmt: str) -> str:
+    """
+    Returns the (strong) ETag of a thumbnail
+
+    :param digest: The hash of the source image
+    :param size: The thumbnail size
+    :param fmt: The thumbnail format
+    :return: The ETag value without quotes
+    """
+
+    return f"{digest}-{size}-{fmt}"
+
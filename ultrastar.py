@@ -0,0 +1,123 @@
+import codecs
+import re
+from typing import Dict, Optional, Tuple
+
+import chardet
+
+# bytes of a file that are used to detect its encoding if it is not utf-8
+DETECTION_PREFIX = 32 * 1024
+
+# chardet only gets the lines with non-ascii characters, at most this many bytes of them
+_DETECTION_SAMPLE_SIZE = 4 * 1024
+
+_NON_ASCII_LINE_PATTERN = re.compile(rb"[^\n]*[\x80-\xff][^\n]*")
+
+_CHUNK_SIZE = 8 * 1024
+
+# the first line that is not a header (e.g. the first note), the headers end there
+_BODY_PATTERN = re.compile(rb"^[ \t]*[^#\s]", re.MULTILINE)
+
+
+def decode(data: bytes, sample: Optional[bytes] = None) -> Tuple[str, str]:
+    """
+    Decodes the content of an UltraStar file
+
+    Strict utf-8 is tried first, only if that fails the encoding is detected with chardet on the beginning of the data.
+
+    :param data: The raw content
+    :param sample: More of the file for the detection of the encoding, if data is only a part of it
+    :return: The text and the encoding that was used
+    """
+
+    if data.startswith(codecs.BOM_UTF8):
+        return data[len(codecs.BOM_UTF8):].decode("utf-8", errors="replace"), "utf-8-sig"
+    if data.startswith((codecs.BOM_UTF16_LE, codecs.BOM_UTF16_BE)):
+        return data.decode("utf-16", errors="replace"), "utf-16"
+
+    try:
+        return data.decode("utf-8"), "utf-8"
+    except UnicodeDecodeError:
+        pass
+
+    # the ascii parts (note numbers, headers) do not help chardet, but make it much slower
+    lines = _NON_ASCII_LINE_PATTERN.findall((sample or data)[:DETECTION_PREFIX])
+    encoding = chardet.detect(b"\n".join(lines)[:_DETECTION_SAMPLE_SIZE])["encoding"]
+    try:
+        # the headers are ascii, an encoding that changes them is a wrong guess (e.g. EBCDIC for short texts)
+        if encoding is not None and b"#:".decode(encoding) == "#:":
+            return data.decode(encoding), encoding
+    except (UnicodeDecodeError, LookupError):
+        pass
+
+    # cp1252 is what most old songs use
+    return data.decode("cp1252", errors="replace"), "cp1252"
+
+
+def parse_headers(text: str) -> Dict[str, str]:
+    """
+    Parses the '#KEY:value' headers of an UltraStar file in a single pass, stopping at the first line that is not a
+    header
+
+    :param text: The content of the file, or at least its beginning
+    :return: The headers with upper case keys, the first value wins if a key is repeated
+    """
+
+    headers = {}
+    for line in text.splitlines():
+        line = line.strip()
+        if not line:
+            continue
+        if not line.startswith("#"):
+            break
+
+        key, separator, value = line[1:].partition(":")
+        if separator:
+            headers.setdefault(key.strip().upper(), value.strip())
+
+    return headers
+
+
+def read_headers(path: str) -> Tuple[Dict[str, str], str]:
+    """
+    Reads the headers of an UltraStar file, only the beginning of the file up to the first note is read and decoded
+
+    :param path: The path of the txt file
+    :return: The headers (see parse_headers) and the encoding of the file
+    """
+
+    data = b""
+    end: Optional[int] = None
+
+    with open(path, "rb") as file:
+        while end is None:
+            chunk = file.read(_CHUNK_SIZE)
+            if not chunk:
+                break
+
+            # continue at the beginning of the last line, it might continue in the new chunk
+            start = data.rfind(b"\n") + 1
+            data += chunk
+
+            if start == 0 and data.startswith(codecs.BOM_UTF8):
+                start = len(codecs.BOM_UTF8)
+
+            if data.startswith((codecs.BOM_UTF16_LE, codecs.BOM_UTF16_BE)):
+                # the lines can not be found in the raw bytes, but utf-16 files are rare
+                data += file.read()
+                break
+
+            match = _BODY_PATTERN.search(data, start)
+            if match is not None:
+                end = match.start()
+
+        header = data[:end] if end is not None else data
+
+        sample = None
+        try:
+            header.decode("utf-8")
+        except UnicodeDecodeError:
+            # the notes contain most of the text, they are needed to detect the encoding reliably
+            sample = data + file.read(max(DETECTION_PREFIX - len(data), 0))
+
+    text, encoding = decode(header, sample)
+    return parse_headers(text), encoding
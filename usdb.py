@@ -1,37 +1,270 @@
+import asyncio
 import logging
-import sys
-from typing import Optional
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Dict, Optional, Tuple
 
-import requests
-from bs4 import BeautifulSoup
+import httpx
+import config
+import http_cache
+import usdb_parser
 
-session = requests.Session()
+BASE_URL = "https://usdb.animux.de"
+
+_lock = threading.Lock()
+_loop: Optional[asyncio.AbstractEventLoop] = None
+_client: Optional[httpx.AsyncClient] = None
+_credentials = None
+_login_lock: Optional[asyncio.Lock] = None
+
+# results of recent song searches by their search arguments, oldest first
+_songs_cache: OrderedDict = OrderedDict()
+_songs_pending: Dict[Tuple, Future] = {}
+_songs_lock = threading.Lock()
+_refresh_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="usdb-refresh")
+_prefetch_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="usdb-prefetch")
+
+# errors worth retrying, everything else (e.g. 404) is returned to the caller
+_RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+
+
+def _get_loop() -> asyncio.AbstractEventLoop:
+    """
+    Returns the event loop of the USDB client, starting it in a background thread on first use.
+
+    All requests to usdb.animux.de run on this loop with a single pooled client, so Flask threads, the proxy and the
+    download workers share the connections and the PHP session without sharing a non-thread-safe session object.
+    """
+
+    global _loop, _client, _login_lock
+
+    with _lock:
+        if _loop is None:
+            loop = asyncio.new_event_loop()
+
+            async def create_client():
+                return httpx.AsyncClient(
+                    base_url=BASE_URL,
+                    follow_redirects=True,
+                    timeout=httpx.Timeout(config.usdb_timeout),
+                    limits=httpx.Limits(max_connections=config.usdb_max_connections, max_keepalive_connections=config.usdb_max_connections)
+                )
+
+            threading.Thread(target=loop.run_forever, name="usdb-client", daemon=True).start()
+            _client = asyncio.run_coroutine_threadsafe(create_client(), loop).result()
+            _login_lock = asyncio.run_coroutine_threadsafe(_create_lock(), loop).result()
+            _loop = loop
+
+    return _loop
+
+
+async def _create_lock() -> asyncio.Lock:
+    return asyncio.Lock()
+
+
+def _is_logged_out(response: httpx.Response) -> bool:
+    return "text/html" in response.headers.get("content-type", "") and "You are not logged in" in response.text
+
+
+async def _login() -> bool:
+    if _credentials is None:
+        return False
+
+    username, password = _credentials
+    await _client.post("/?link=home", data={
+        'user': username,
+        'pass': password,
+        'login': 'Login'
+    })
+
+    response = await _client.get("/?link=browse")
+    return not _is_logged_out(response)
+
+
+async def _request(method: str, url: str, relogin: bool = True, **kwargs) -> httpx.Response:
+    for attempt in range(config.usdb_retries + 1):
+        try:
+            response = await _client.request(method, url, **kwargs)
+        except httpx.TransportError as e:
+            if attempt == config.usdb_retries:
+                raise
+            logging.warning(f"Request to {url} failed ({e}), retrying")
+        else:
+            if response.status_code in _RETRY_STATUS_CODES and attempt < config.usdb_retries:
+                logging.warning(f"Request to {url} failed with status {response.status_code}, retrying")
+            elif relogin and _is_logged_out(response):
+                # the PHP session expired, log in again (only once for concurrent requests) and repeat the request
+                session = _client.cookies.get("PHPSESSID")
+                async with _login_lock:
+                    if session == _client.cookies.get("PHPSESSID"):
+                        logging.info("USDB session expired, logging in again")
+                        await _login()
+                return await _request(method, url, relogin=False, **kwargs)
+            else:
+                return response
+
+        await asyncio.sleep(0.5 * 2 ** attempt)
+
+
+def _submit(method: str, url: str, **kwargs) -> Future:
+    return asyncio.run_coroutine_threadsafe(_request(method, url, **kwargs), _get_loop())
+
+
+def request(method: str, url: str, **kwargs) -> httpx.Response:
+    """
+    Sends a request to usdb.animux.de and waits for the response (thread-safe).
+
+    Failed connections and temporary server errors are retried with a backoff and the login is repeated if the
+    PHP session expired.
+
+    :param method: The HTTP method
+    :param url: The url, either absolute or relative to https://usdb.animux.de
+    :param kwargs: Further arguments for httpx (e.g. data, headers)
+    :return: The response
+    """
+
+    return _submit(method, url, **kwargs).result()
+
+
+async def request_async(method: str, url: str, **kwargs) -> httpx.Response:
+    """
+    Like request, but can be awaited from any event loop without blocking it
+
+    :param method: The HTTP method
+    :param url: The url, either absolute or relative to https://usdb.animux.de
+    :param kwargs: Further arguments for httpx (e.g. data, headers)
+    :return: The response
+    """
+
+    return await asyncio.wrap_future(_submit(method, url, **kwargs))
+
+
+class StreamedResponse:
+    """
+    A response of usdb.animux.de whose body is read chunk by chunk (see open_stream)
+    """
+
+    def __init__(self, response: httpx.Response):
+        self.status_code = response.status_code
+        self.headers = response.headers
+        self._response = response
+
+    def iter_bytes(self):
+        """
+        Yields the (decoded) body in chunks as they arrive, the response is closed afterwards
+        """
+
+        chunks = self._response.aiter_bytes()
+
+        async def next_chunk():
+            try:
+                return await chunks.__anext__()
+            except StopAsyncIteration:
+                return None
+
+        try:
+            while True:
+                chunk = asyncio.run_coroutine_threadsafe(next_chunk(), _loop).result()
+                if chunk is None:
+                    break
+                yield chunk
+        finally:
+            self.close()
+
+    def close(self):
+        """
+        Closes the response, the remaining body is discarded
+        """
+
+        if not self._response.is_closed:
+            asyncio.run_coroutine_threadsafe(self._response.aclose(), _loop).result()
+
+
+async def _open_stream(method: str, url: str, **kwargs) -> StreamedResponse:
+    for attempt in range(config.usdb_retries + 1):
+        try:
+            return StreamedResponse(await _client.send(_client.build_request(method, url, **kwargs), stream=True))
+        except httpx.TransportError as e:
+            if attempt == config.usdb_retries:
+                raise
+            logging.warning(f"Request to {url} failed ({e}), retrying")
+
+        await asyncio.sleep(0.5 * 2 ** attempt)
+
+
+def open_stream(method: str, url: str, **kwargs) -> StreamedResponse:
+    """
+    Sends a request to usdb.animux.de and returns as soon as the headers arrived (thread-safe).
+
+    Unlike request, the body is not read into memory, so it can be passed on while it is downloaded. The response has
+    to be read completely or closed to release the connection.
+
+    :param method: The HTTP method
+    :param url: The url, either absolute or relative to https://usdb.animux.de
+    :param kwargs: Further arguments for httpx (e.g. content, headers)
+    :return: The response
+    """
+
+    return asyncio.run_coroutine_threadsafe(_open_stream(method, url, **kwargs), _get_loop()).result()
+
+
+# static files of usdb.animux.de (covers, images, ...), shared by the proxy, the cover route and the downloads
+cache = http_cache.HttpCache(os.path.join(config.cache_dir, "usdb"), open_stream, config.usdb_proxy_cache_size * 1024 * 1024, config.usdb_proxy_cache_ttl)
+
+
+def get_cover(id) -> Optional[str]:
+    """
+    Returns the cover of a song on usdb.animux.de, it is downloaded into the cache if needed (blocking)
+
+    :param id: The usdb id
+    :return: The path of the cached cover or None if the song has no cover
+    """
+
+    entry = cache.get(f"{BASE_URL}/data/cover/{int(id)}.jpg")
+    if entry.status_code != 200 or entry.path is None:
+        return None
+    return entry.path
+
+
+def prefetch_covers(ids):
+    """
+    Downloads the covers of songs into the cache in the background
+
+    :param ids: The usdb ids
+    """
+
+    for id in ids:
+        _prefetch_executor.submit(_prefetch_cover, id)
+
+
+def _prefetch_cover(id):
+    try:
+        get_cover(id)
+    except Exception as e:
+        logging.debug(f"Could not prefetch the cover of {id}: {e}")
 
 
 def login(username, password) -> bool:
     """
     Performs the login to usdb.animux.de
 
+    The credentials are kept to log in again when the session expires.
+
     :param username: The username to use
     :param password: The password to use
     :return: True if the login was successful
     """
 
-    payload = {
-        'user': username,
-        'pass': password,
-        'login': 'Login'
-    }
-
-    session.post('https://usdb.animux.de/?link=home', data=payload)
+    global _credentials
+    _credentials = (username, password)
 
-    if "You are not logged in" in session.get("https://usdb.animux.de/?link=browse").text:
-        return False
-    else:
-        return True
+    return asyncio.run_coroutine_threadsafe(_login(), _get_loop()).result()
 
 
-def get_songs(artist: Optional[str] = None, title: Optional[str] = None, edition: Optional[str] = None, language: Optional[str] = None, genre: Optional[str] = None, order: str = "rating", ud: str = "desc", golden: bool = False, songcheck: bool = False, limit: int = 30, page: int = 1):
+def get_songs(artist: Optional[str] = None, title: Optional[str] = None, edition: Optional[str] = None, language: Optional[str] = None, genre: Optional[str] = None, order: str = "rating", ud: str = "desc", golden: bool = False, songcheck: bool = False, limit: int = 30, page: int = 1, cached: bool = True):
     """
     Returns a list of all songs that match the search criteria
 
@@ -56,18 +289,19 @@ def get_songs(artist: Optional[str] = None, title: Optional[str] = None, edition
     :param songcheck: only songs with songcheck
     :param limit: How many songs to fetch
     :param page: The page for paging (starting at 1)
-    :return: A list of songs
+    :param cached: Allow answering from the cache of recent searches
+    :return: A list of songs, the result is shared with other callers and must not be modified
     """
 
     payload = {
-        "interpret": artist or "",
-        "title": title or "",
-        "edition": edition or "",
-        "language": language or "",
-        "genre": genre or "",
+        "interpret": (artist or "").strip(),
+        "title": (title or "").strip(),
+        "edition": (edition or "").strip(),
+        "language": (language or "").strip(),
+        "genre": (genre or "").strip(),
         "order": order,
         "ud": ud,
-        "limit": str(limit),
+        "limit": str(int(limit)),
         "start": str((int(page) - 1) * int(limit))
     }
     if golden:
@@ -75,57 +309,66 @@ def get_songs(artist: Optional[str] = None, title: Optional[str] = None, edition
     if songcheck:
         payload["songcheck"] = "1"
 
-    response = session.post('https://usdb.animux.de/?link=list', data=payload)
+    if not cached:
+        return _fetch_songs(payload, int(page))
 
-    # Parse the HTML content
-    soup = BeautifulSoup(response.text, "html.parser")
+    key = tuple(sorted(payload.items()))
+    now = time.monotonic()
 
-    result = {
-        "paging": {
-            "current": int(page),
-            "pages": int(page)
-        }
-    }
-    # get the actual last page
-    for current in soup.select('a:has(> b > u) ~ a:nth-last-of-type(1)'):
-        result["paging"]["pages"] = int(current.get_text()[1:-1])
-
-    # TODO: get total number of songs
-
-    # Extract table rows
-    rows = soup.select('.row1 table tr:not(.list_head)')
-
-    # Create a list to hold dictionaries (each dictionary represents a row in the table)
-    data = []
-
-    # Iterate over each row, starting from the second one (because the first row contains headers)
-    for row in rows:
-        # Extract table data (td) from each row
-        tds = row.select("td")
-
-        rating = len(tds[8].select("img[src='images/star.png']")) + 0.5 * len(tds[8].select("img[src='images/half_star.png']"))
-
-        # Extracting relevant information from each td and adding to a dictionary
-        row_data = {
-            "id": int(tds[0].get_attribute_list("onclick")[0].split("(")[-1].rstrip(")")),
-            "artist": tds[0].get_text(strip=True),
-            "title": tds[1].get_text(strip=True),
-            "edition": tds[2].get_text(strip=True),
-            "golden": tds[3].get_text(strip=True) == "Ja",
-            # "language": tds[4].get_text(strip=True),
-            "language": tds[6].get_text(strip=True),
-            # "rating": len(tds[5].select("img[src='images/star.png']")) + 0.5 * len(tds[5].select("img[src='images/half_star.png']")),
-            "rating": rating,
-            "views": int(tds[9].get_text(strip=True))
-            # "views": 0
-        }
-
-        # Add the dictionary to the list
-        data.append(row_data)
-
-    # Output the extracted data
-    logging.info(f"Fetched {len(data)} Songs from USDB")
-
-    result["songs"] = data
+    with _songs_lock:
+        entry = _songs_cache.get(key)
+        if entry is not None:
+            fetched, result = entry
+            age = now - fetched
+
+            if age < config.usdb_cache_ttl + config.usdb_cache_stale:
+                _songs_cache.move_to_end(key)
+
+                # serve the outdated result right away and update it in the background
+                if age >= config.usdb_cache_ttl and key not in _songs_pending:
+                    _songs_pending[key] = _refresh_executor.submit(_fetch_songs_into_cache, key, payload, int(page))
+
+                return result
+
+        future = _songs_pending.get(key)
+        created = future is None
+        if created:
+            future = _songs_pending[key] = Future()
+
+    # identical searches that are already running are waited for instead of being sent again
+    if not created:
+        return future.result()
+
+    try:
+        result = _fetch_songs_into_cache(key, payload, int(page))
+    except BaseException as e:
+        future.set_exception(e)
+        raise
+
+    future.set_result(result)
+    return result
+
+
+def _fetch_songs_into_cache(key: Tuple, payload: dict, page: int) -> dict:
+    try:
+        result = _fetch_songs(payload, page)
+
+        with _songs_lock:
+            _songs_cache[key] = (time.monotonic(), result)
+            _songs_cache.move_to_end(key)
+            while len(_songs_cache) > config.usdb_cache_size:
+                _songs_cache.popitem(last=False)
+
+        return result
+    finally:
+        with _songs_lock:
+            _songs_pending.pop(key, None)
+
+
+def _fetch_songs(payload: dict, page: int) -> dict:
+    response = request("POST", "/?link=list", data=payload)
+
+    result = usdb_parser.parse_song_list(response.text, page)
+    logging.info(f"Fetched {len(result['songs'])} Songs from USDB")
 
     return result
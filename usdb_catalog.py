@@ -0,0 +1,262 @@
+import logging
+import math
+import re
+import sqlite3
+import threading
+import time
+from typing import Iterable, List, Optional
+
+import usdb
+
+_FIELDS = ["id", "artist", "title", "edition", "golden", "language", "rating", "views"]
+
+# the sort orders of usdb.get_songs and the matching columns
+_ORDERS = {
+    "id": "id",
+    "artist": "artist COLLATE NOCASE",
+    "title": "title COLLATE NOCASE",
+    "edition": "edition COLLATE NOCASE",
+    "rating": "rating",
+    "language": "language COLLATE NOCASE",
+    "views": "views",
+    "golden": "golden"
+}
+
+_TOKEN_PATTERN = re.compile(r"\w+")
+
+_PAGE_SIZE = 100
+
+
+class UsdbCatalog:
+    """
+    Local copy of the song list of usdb.animux.de
+
+    The catalog is filled by a background sync that crawls the song list ordered by id. The first sync (and a full
+    sync every few days to update ratings and views and to remove deleted songs) reads all pages, later syncs only read
+    pages until they reach songs that are already known. Searches use a full text index, so they do not need
+    usdb.animux.de and also return the total number of matching songs.
+    """
+
+    def __init__(self, file_name: str):
+        """
+        Opens (and if needed creates) the catalog
+
+        :param file_name: The path to the sqlite database
+        """
+
+        self.file_name = file_name
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(file_name, check_same_thread=False)
+        self._connection.executescript("""
+            CREATE TABLE IF NOT EXISTS songs (
+                id INTEGER PRIMARY KEY,
+                artist TEXT NOT NULL,
+                title TEXT NOT NULL,
+                edition TEXT NOT NULL,
+                golden INTEGER NOT NULL,
+                language TEXT NOT NULL,
+                rating REAL NOT NULL,
+                views INTEGER NOT NULL,
+                synced REAL NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS state (
+                key TEXT PRIMARY KEY,
+                value
+            );
+        """)
+
+        try:
+            self._connection.executescript("""
+                CREATE VIRTUAL TABLE IF NOT EXISTS songs_fts USING fts5(artist, title, edition, content='songs', content_rowid='id', tokenize='unicode61 remove_diacritics 2');
+                CREATE TRIGGER IF NOT EXISTS songs_insert AFTER INSERT ON songs BEGIN
+                    INSERT INTO songs_fts (rowid, artist, title, edition) VALUES (new.id, new.artist, new.title, new.edition);
+                END;
+                CREATE TRIGGER IF NOT EXISTS songs_delete AFTER DELETE ON songs BEGIN
+                    INSERT INTO songs_fts (songs_fts, rowid, artist, title, edition) VALUES ('delete', old.id, old.artist, old.title, old.edition);
+                END;
+                CREATE TRIGGER IF NOT EXISTS songs_update AFTER UPDATE ON songs BEGIN
+                    INSERT INTO songs_fts (songs_fts, rowid, artist, title, edition) VALUES ('delete', old.id, old.artist, old.title, old.edition);
+                    INSERT INTO songs_fts (rowid, artist, title, edition) VALUES (new.id, new.artist, new.title, new.edition);
+                END;
+            """)
+            self.full_text = True
+        except sqlite3.OperationalError as e:
+            logging.warning(f"SQLite has no full text search ({e}), searching the USDB catalog will be slower")
+            self.full_text = False
+
+        self._connection.commit()
+
+    def _execute(self, sql: str, parameters: Iterable = ()) -> list:
+        with self._lock:
+            with self._connection:
+                return self._connection.execute(sql, tuple(parameters)).fetchall()
+
+    def _get_state(self, key: str, default=None):
+        rows = self._execute("SELECT value FROM state WHERE key = ?", (key,))
+        return rows[0][0] if rows else default
+
+    def _set_state(self, key: str, value):
+        self._execute("INSERT OR REPLACE INTO state (key, value) VALUES (?, ?)", (key, value))
+
+    @property
+    def complete(self) -> bool:
+        """
+        True if the catalog contains all songs of usdb.animux.de (at the time of the last sync)
+        """
+
+        return self._get_state("complete", 0) == 1
+
+    def put(self, songs: List[dict]):
+        """
+        Adds or updates songs
+
+        :param songs: The songs as returned by usdb.get_songs
+        """
+
+        now = time.time()
+        rows = [(song["id"], song["artist"], song["title"], song["edition"], int(song["golden"]), song["language"], song["rating"], song["views"], now) for song in songs]
+
+        with self._lock:
+            with self._connection:
+                # an upsert instead of INSERT OR REPLACE, so the update trigger keeps the full text index up to date
+                self._connection.executemany(f"""
+                    INSERT INTO songs ({', '.join(_FIELDS)}, synced) VALUES ({', '.join('?' * (len(_FIELDS) + 1))})
+                    ON CONFLICT (id) DO UPDATE SET artist = excluded.artist, title = excluded.title, edition = excluded.edition,
+                        golden = excluded.golden, language = excluded.language, rating = excluded.rating, views = excluded.views,
+                        synced = excluded.synced
+                """, rows)
+
+    def _text_filter(self, column: str, text: Optional[str], conditions: List[str], parameters: list):
+        tokens = _TOKEN_PATTERN.findall(text or "")
+        if not tokens:
+            return
+
+        if self.full_text:
+            # every word has to match the start of a word in the column
+            conditions.append("id IN (SELECT rowid FROM songs_fts WHERE songs_fts MATCH ?)")
+            parameters.append(" AND ".join(f'{column} : "{token}"*' for token in tokens))
+        else:
+            for token in tokens:
+                conditions.append(f"{column} LIKE ?")
+                parameters.append(f"%{token}%")
+
+    def get_songs(self, artist: Optional[str] = None, title: Optional[str] = None, edition: Optional[str] = None, language: Optional[str] = None, order: str = "rating", ud: str = "desc", golden: bool = False, limit: int = 30, page: int = 1) -> dict:
+        """
+        Searches the catalog, takes the same arguments as usdb.get_songs (except for genre and songcheck, which are not
+        part of the song list)
+
+        :return: The paging, the total number of matching songs and the songs of the page
+        """
+
+        conditions = []
+        parameters = []
+
+        self._text_filter("artist", artist, conditions, parameters)
+        self._text_filter("title", title, conditions, parameters)
+        self._text_filter("edition", edition, conditions, parameters)
+
+        if language:
+            conditions.append("language = ? COLLATE NOCASE")
+            parameters.append(language.strip())
+        if golden:
+            conditions.append("golden = 1")
+
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        direction = "ASC" if ud == "asc" else "DESC"
+        limit = int(limit)
+        page = max(int(page), 1)
+
+        total = self._execute(f"SELECT COUNT(*) FROM songs {where}", parameters)[0][0]
+        rows = self._execute(
+            f"SELECT {', '.join(_FIELDS)} FROM songs {where} ORDER BY {_ORDERS.get(order, 'rating')} {direction}, id {direction} LIMIT ? OFFSET ?",
+            parameters + [limit, (page - 1) * limit]
+        )
+
+        songs = []
+        for row in rows:
+            song = dict(zip(_FIELDS, row))
+            song["golden"] = bool(song["golden"])
+            songs.append(song)
+
+        return {
+            "paging": {
+                "current": page,
+                "pages": max(math.ceil(total / limit), 1)
+            },
+            "total": total,
+            "songs": songs
+        }
+
+    def sync(self, full_sync_interval: float, delay: float = 1):
+        """
+        Updates the catalog from usdb.animux.de (blocking)
+
+        :param full_sync_interval: Seconds after which all pages are read again instead of only the new songs
+        :param delay: Seconds to wait between two pages, to not put too much load on usdb.animux.de
+        """
+
+        last_full_sync = self._get_state("last_full_sync", 0)
+        full = not self.complete or time.time() - last_full_sync > full_sync_interval
+
+        if full:
+            # an interrupted full sync continues where it stopped (one page earlier, since the pages may have moved)
+            started = self._get_state("full_sync_started") or time.time()
+            self._set_state("full_sync_started", started)
+            page = max(self._get_state("full_sync_page", 1) - 1, 1)
+            newest = None
+            logging.info(f"Starting full sync of the USDB catalog at page {page}")
+        else:
+            started = time.time()
+            page = 1
+            newest = self._execute("SELECT MAX(id) FROM songs")[0][0]
+
+        added = 0
+        while True:
+            result = usdb.get_songs(order="id", ud="desc", limit=_PAGE_SIZE, page=page, cached=False)
+            songs = result["songs"]
+            self.put(songs)
+            added += len(songs)
+
+            if full:
+                self._set_state("full_sync_page", page)
+
+            if not songs or page >= result["paging"]["pages"] or (newest is not None and songs[-1]["id"] <= newest):
+                break
+
+            page += 1
+            time.sleep(delay)
+
+        if full:
+            # songs that were not seen during the full sync have been deleted on usdb.animux.de
+            with self._lock:
+                with self._connection:
+                    removed = self._connection.execute("DELETE FROM songs WHERE synced < ?", (started,)).rowcount
+            self._set_state("complete", 1)
+            self._set_state("last_full_sync", time.time())
+            self._execute("DELETE FROM state WHERE key IN ('full_sync_started', 'full_sync_page')")
+            logging.info(f"Full sync of the USDB catalog finished with {self.count()} songs ({removed} removed)")
+        else:
+            logging.info(f"Synced {added} songs of the USDB catalog")
+
+    def sync_forever(self, interval: float, full_sync_interval: float):
+        """
+        Syncs the catalog periodically (blocking), errors are logged and the sync is tried again after the interval
+
+        :param interval: Seconds between two syncs
+        :param full_sync_interval: Seconds after which all pages are read again instead of only the new songs
+        """
+
+        while True:
+            try:
+                self.sync(full_sync_interval)
+            except Exception as e:
+                logging.error(f"Could not sync the USDB catalog: {e}")
+
+            time.sleep(interval)
+
+    def count(self) -> int:
+        """
+        :return: The number of songs in the catalog
+        """
+
+        return self._execute("SELECT COUNT(*) FROM songs")[0][0]
@@ -0,0 +1,143 @@
+import re
+from typing import List
+
+from bs4 import BeautifulSoup
+
+try:
+    import lxml.html
+except ImportError:
+    lxml = None
+
+_CLASS = "contains(concat(' ', normalize-space(@class), ' '), ' {} ')"
+
+# the same elements as the css selectors of the BeautifulSoup parser
+_ROWS_XPATH = f"//*[{_CLASS.format('row1')}]//table//tr[not({_CLASS.format('list_head')})]"
+_LAST_PAGE_XPATH = "//a[b/u]/following-sibling::a[last()]"
+
+_ID_PATTERN = re.compile(r"\((\d+)\)\s*$")
+
+
+def parse_song_list(html: str, page: int) -> dict:
+    """
+    Extracts the songs and the paging from a song list page of usdb.animux.de
+
+    Uses lxml if it is installed, which is many times faster than BeautifulSoup on large pages.
+
+    :param html: The html of the page
+    :param page: The requested page (starting at 1)
+    :return: A dict with the paging and the songs
+    """
+
+    if lxml is not None:
+        return parse_song_list_lxml(html, page)
+    return parse_song_list_bs4(html, page)
+
+
+def _text(element) -> str:
+    # like get_text(strip=True) of BeautifulSoup
+    return "".join(text.strip() for text in element.itertext())
+
+
+def _count_stars(td, full: str, half: str) -> float:
+    stars = 0.0
+    for img in td.iter("img"):
+        src = img.get("src")
+        if src == full:
+            stars += 1
+        elif src == half:
+            stars += 0.5
+    return stars
+
+
+def parse_song_list_lxml(html: str, page: int) -> dict:
+    """
+    Like parse_song_list, but always uses lxml
+    """
+
+    document = lxml.html.document_fromstring(html)
+
+    result = {
+        "paging": {
+            "current": int(page),
+            "pages": int(page)
+        }
+    }
+    # get the actual last page
+    for current in document.xpath(_LAST_PAGE_XPATH):
+        result["paging"]["pages"] = int(_text(current)[1:-1])
+
+    data = []
+    for row in document.xpath(_ROWS_XPATH):
+        tds = [child for child in row if child.tag == "td"]
+
+        data.append({
+            "id": int(_ID_PATTERN.search(tds[0].get("onclick")).group(1)),
+            "artist": _text(tds[0]),
+            "title": _text(tds[1]),
+            "edition": _text(tds[2]),
+            "golden": _text(tds[3]) == "Ja",
+            "language": _text(tds[6]),
+            "rating": _count_stars(tds[8], "images/star.png", "images/half_star.png"),
+            "views": int(_text(tds[9]))
+        })
+
+    result["songs"] = data
+
+    return result
+
+
+def parse_song_list_bs4(html: str, page: int) -> dict:
+    """
+    Like parse_song_list, but always uses BeautifulSoup
+    """
+
+    soup = BeautifulSoup(html, "html.parser")
+
+    result = {
+        "paging": {
+            "current": int(page),
+            "pages": int(page)
+        }
+    }
+    # get the actual last page
+    # (same as 'a:has(> b > u) ~ a:nth-last-of-type(1)', which newer soupsieve versions reject)
+    for current_page in soup.select("a > b > u"):
+        following = current_page.parent.parent.find_next_siblings("a")
+        if following:
+            result["paging"]["pages"] = int(following[-1].get_text()[1:-1])
+
+    # TODO: get total number of songs
+
+    # Extract table rows
+    rows = soup.select('.row1 table tr:not(.list_head)')
+
+    # Create a list to hold dictionaries (each dictionary represents a row in the table)
+    data: List[dict] = []
+
+    for row in rows:
+        # Extract table data (td) from each row
+        tds = row.select("td")
+
+        rating = len(tds[8].select("img[src='images/star.png']")) + 0.5 * len(tds[8].select("img[src='images/half_star.png']"))
+
+        # Extracting relevant information from each td and adding to a dictionary
+        row_data = {
+            "id": int(tds[0].get_attribute_list("onclick")[0].split("(")[-1].rstrip(")")),
+            "artist": tds[0].get_text(strip=True),
+            "title": tds[1].get_text(strip=True),
+            "edition": tds[2].get_text(strip=True),
+            "golden": tds[3].get_text(strip=True) == "Ja",
+            # "language": tds[4].get_text(strip=True),
+            "language": tds[6].get_text(strip=True),
+            # "rating": len(tds[5].select("img[src='images/star.png']")) + 0.5 * len(tds[5].select("img[src='images/half_star.png']")),
+            "rating": rating,
+            "views": int(tds[9].get_text(strip=True))
+            # "views": 0
+        }
+
+        # Add the dictionary to the list
+        data.append(row_data)
+
+    result["songs"] = data
+
+    return result
@@ -0,0 +1,87 @@
+import logging
+import threading
+from typing import Optional
+
+from flask import Flask
+from werkzeug.serving import make_server
+
+import config
+
+try:
+    import waitress
+except ImportError:
+    waitress = None
+
+
+class WebServer:
+    """
+    Serves the flask app in a background thread
+
+    Uses waitress, a multi-threaded production server with keep-alive connections, if it is installed and not
+    disabled in the config. Otherwise the werkzeug development server is used (with a thread per request).
+    """
+
+    def __init__(self, app: Flask, host: str, port: int):
+        """
+        :param app: The flask app
+        :param host: The address to listen on
+        :param port: The port to listen on
+        """
+
+        self.app = app
+        self.host = host
+        self.port = port
+        self._server = None
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def production(self) -> bool:
+        return waitress is not None and config.http_server == "waitress"
+
+    def start(self):
+        """
+        Binds the port and starts serving requests in a daemon thread
+        """
+
+        if self.production:
+            self._server = waitress.create_server(
+                self.app,
+                host=self.host,
+                port=self.port,
+                threads=config.http_threads,
+                connection_limit=config.http_connection_limit,
+                channel_timeout=config.http_keep_alive,
+                ident="Ultrastar Wingman"
+            )
+            target = self._server.run
+            logging.info(f"Serving on http://{self.host}:{self.port} with waitress ({config.http_threads} threads)")
+        else:
+            if config.http_server == "waitress":
+                logging.warning("waitress is not installed, using the development server, which does not handle many clients well")
+
+            self._server = make_server(self.host, self.port, self.app, threaded=True)
+            target = self._server.serve_forever
+            logging.info(f"Serving on http://{self.host}:{self.port} with the development server")
+
+        self._thread = threading.Thread(target=target, name="http", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float):
+        """
+        Stops accepting connections and waits for the requests that are being handled (blocking)
+
+        :param timeout: The maximum number of seconds to wait for the running requests
+        """
+
+        if self._server is None:
+            return
+
+        if self.production:
+            # the worker threads finish their current requests, queued requests are dropped
+            self._server.task_dispatcher.shutdown(timeout=timeout)
+            self._server.close()
+        else:
+            self._server.shutdown()
+            self._thread.join(timeout)
+
+        self._server = None
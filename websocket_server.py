@@ -1,48 +1,293 @@
 import asyncio
+import collections
 import json
 import logging
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Deque, Dict, Optional, Set
+
 import websockets
 
+import config
+from job_store import JobStore
 from song import Song
 
+# seconds a new client has to send its resume message before it is treated as a client without history
+RESUME_TIMEOUT = 5
+
+# the topic of every message type, clients only receive the topics they subscribed to
+TOPICS = {
+    "log": "log",
+    "error": "log",
+    "download": "downloads",
+    "progress": "downloads",
+    "library": "library",
+    "players": "players"
+}
+
+
+class _Message:
+    """
+    A message as it is sent to the clients, it is serialized only once for all of them
+    """
+
+    __slots__ = ("seq", "topic", "data", "console", "coalesce")
+
+    def __init__(self, seq: int, topic: str, message: dict, coalesce: Optional[str]):
+        self.seq = seq
+        self.topic = topic
+        self.data = json.dumps(message)
+        self.console = "msg" in message
+        self.coalesce = coalesce
+
+
+class _Client:
+    """
+    A connected websocket with its subscriptions and its own send queue.
+
+    Every client is sent to by its own task, so a slow phone only delays its own messages. Messages with the same
+    coalesce key (e.g. the state of one download) replace each other while they are waiting. If a client falls too
+    far behind, it is disconnected and catches up from the history when it reconnects.
+    """
+
+    def __init__(self, websocket, topics: Optional[Set[str]]):
+        self.websocket = websocket
+        self.topics = topics
+        self.pending: "collections.OrderedDict[object, str]" = collections.OrderedDict()
+        self.wakeup = asyncio.Event()
+        self.task: Optional[asyncio.Task] = None
+        # True while waiting for the websocket to accept a message, only then the client is really behind
+        self.sending = False
+
+    def wants(self, message: _Message) -> bool:
+        return self.topics is None or message.topic in self.topics
+
+    def put(self, message: _Message):
+        key = message.coalesce if message.coalesce is not None else message.seq
+        self.pending.pop(key, None)
+        self.pending[key] = message.data
+
+        if self.sending and len(self.pending) > config.websocket_client_queue:
+            logging.warning(f"Disconnecting websocket client {self.websocket.remote_address}, it does not keep up with the messages")
+            self.pending.clear()
+            asyncio.ensure_future(self.websocket.close(1013, "too slow"))
+            return
+
+        self.wakeup.set()
+
+    async def send_pending(self):
+        while True:
+            await self.wakeup.wait()
+            self.wakeup.clear()
+
+            while self.pending:
+                _, data = self.pending.popitem(last=False)
+                self.sending = True
+                try:
+                    await self.websocket.send(data)
+                finally:
+                    self.sending = False
 
-messages = []
 
 class WebSocketServer:
-    def __init__(self, download_queue: asyncio.Queue):
+    def __init__(self, download_queue: asyncio.Queue, job_store: JobStore):
         self.download_queue = download_queue
+        self.job_store = job_store
+        # sqlite commits block, a single thread keeps the updates of a job in order
+        self.job_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="job-store")
+
+        self.clients: Dict[object, _Client] = {}
 
-        self.clients = set()
+        # the latest messages with increasing sequence numbers, so (re)connecting clients can catch up
+        self.seq = 0
+        # identifies this run of the server, the sequence numbers of an earlier run mean nothing
+        self.epoch = uuid.uuid4().hex
+        self.history: Deque[_Message] = collections.deque(maxlen=config.message_history)
 
-    async def register(self, websocket):
-        self.clients.add(websocket)
+    async def register(self, client: _Client):
+        self.clients[client.websocket] = client
+        client.task = asyncio.ensure_future(client.send_pending())
 
-    async def unregister(self, websocket):
-        self.clients.remove(websocket)
+    async def unregister(self, client: _Client):
+        self.clients.pop(client.websocket, None)
+        if client.task is not None:
+            client.task.cancel()
+
+    async def send_to_clients(self, message: dict, coalesce: Optional[str] = None, history: bool = True):
+        """
+        Sends a message to all clients that subscribed to its topic and adds it to the history
+
+        :param message: The message, its type determines the topic
+        :param coalesce: Waiting messages with the same key are replaced by this one for clients that are behind
+        :param history: False for frequent, short-lived messages (like progress) that are not worth replaying
+        """
 
-    async def send_to_clients(self, message):
         logging.debug(f"Sending {message}")
-        messages.append(message)
-        if self.clients:
-            websockets.broadcast(self.clients, json.dumps(message))
+        self.seq += 1
+        message = _Message(self.seq, TOPICS.get(message.get("type"), "log"), {**message, "seq": self.seq}, coalesce)
+        if history:
+            self.history.append(message)
+
+        for client in self.clients.values():
+            if client.wants(message):
+                client.put(message)
+
+    async def send_players_change(self, action: str, name: str):
+        """
+        Notifies the clients about a player that was added or removed
+
+        :param action: 'added' or 'removed'
+        :param name: The name of the player
+        """
+
+        await self.send_to_clients({
+            "type": "players",
+            "action": action,
+            "name": name
+        })
+
+    async def send_library_change(self, action: str, song: Song):
+        """
+        Notifies the clients about a song that was added, updated or removed on disk
+
+        :param action: 'added', 'updated' or 'removed'
+        :param song: The affected song
+        """
+
+        await self.send_to_clients({
+            "msg": f"Song {action}: {song}",
+            "type": "library",
+            "action": action,
+            "song": song.to_json(),
+            "source": song.source
+        })
+
+    def get_history(self, seq: Optional[int], topics: Optional[Set[str]] = None, epoch: Optional[str] = None) -> str:
+        """
+        Returns the messages a client has not seen yet
+
+        :param seq: The sequence number of the last message the client received, None for a new client
+        :param topics: The topics the client subscribed to, None for all topics
+        :param epoch: The epoch of the server the client received its last message from
+        :return: The serialized history message, a new client only gets the messages for the console
+        """
+
+        # the client knows messages from before a restart of the server, the numbering started again
+        reset = seq is not None and (epoch != self.epoch or seq > self.seq)
+        if reset:
+            seq = 0
+
+        messages = [
+            message.data for message in self.history
+            if (topics is None or message.topic in topics) and (message.console if seq is None else message.seq > seq)
+        ]
+
+        # the messages are already serialized, so they are only joined
+        return f'{{"type": "history", "epoch": "{self.epoch}", "resumed": {json.dumps(seq is not None)}, "reset": {json.dumps(reset)}, "messages": [{", ".join(messages)}]}}'
+
+    @staticmethod
+    def _parse_topics(topics) -> Optional[Set[str]]:
+        if not isinstance(topics, list):
+            return None
+        return {topic for topic in topics if isinstance(topic, str)}
 
     async def handler(self, websocket, path):
-        await self.register(websocket)
+        # the client first tells which messages it already has (e.g. after a reconnect) and which topics it wants
+        seq = None
+        topics = None
+        epoch = None
+        try:
+            resume = json.loads(await asyncio.wait_for(websocket.recv(), RESUME_TIMEOUT))
+            if resume.get("type") == "resume":
+                if isinstance(resume.get("seq"), int):
+                    seq = resume["seq"]
+                epoch = resume.get("epoch")
+                topics = self._parse_topics(resume.get("topics"))
+        except (asyncio.TimeoutError, ValueError, AttributeError):
+            pass
+        except websockets.ConnectionClosed:
+            return
+
+        client = _Client(websocket, topics)
+
+        # nothing can be sent between taking the history and registering the client, so no message gets lost
+        history = self.get_history(seq, topics, epoch)
+        await self.register(client)
+        client.pending[0] = history
+        client.pending.move_to_end(0, last=False)
+        client.wakeup.set()
+
         try:
             async for message in websocket:
-                print(f"Received message from client: {message}")
+                try:
+                    message = json.loads(message)
+                    requested = self._parse_topics(message.get("topics"))
+                except (ValueError, AttributeError):
+                    logging.warning(f"Invalid message from websocket client: {message}")
+                    continue
+
+                if requested is None:
+                    continue
+
+                if message.get("type") == "subscribe":
+                    client.topics = requested if client.topics is None else client.topics | requested
+                elif message.get("type") == "unsubscribe":
+                    client.topics = (set(TOPICS.values()) if client.topics is None else client.topics) - requested
+        except websockets.ConnectionClosed:
+            pass
         except Exception as e:
             logging.error(f"Error on websocket: {e}")
         finally:
-            await self.unregister(websocket)
+            await self.unregister(client)
 
     async def message_queue_consumer(self):
         while True:
             message = await self.message_queue.get()
             await self.send_to_clients(message)
 
+    async def send_download_state(self, id: int, state: str, song: Optional[Song] = None):
+        """
+        Notifies all clients about the state of a download, so every phone shows the same state for a song
+
+        :param id: The usdb id of the song
+        :param state: 'queued', 'started', 'finished' or 'failed'
+        :param song: The downloaded song once it is finished
+        """
+
+        await self.send_to_clients({
+            "type": "download",
+            "id": id,
+            "state": state,
+            "song": song.to_json() if song is not None else None
+        }, coalesce=f"download:{id}")
+
+    def send_download_progress(self, id: int, stage: str, progress: dict):
+        """
+        Notifies the clients about the progress of a running download
+
+        :param id: The usdb id of the song
+        :param stage: The stage of the download
+        :param progress: The progress of the stage (percent, speed and eta if known)
+        """
+
+        asyncio.ensure_future(self.send_to_clients({
+            "type": "progress",
+            "id": id,
+            "stage": stage,
+            **progress
+        }, coalesce=f"progress:{id}", history=False))
+
+    async def enqueue_download(self, id: int):
+        """
+        Puts a download on the queue and notifies the clients
+
+        :param id: The usdb id of the song
+        """
+
+        await self.download_queue.put(id)
+        await self.send_download_state(id, "queued")
+
     async def download_queue_consumer(self, i):
-        # TODO: not actually threaded
         await self.send_to_clients({
             "msg": f"[Downloader {i}] Ready",
             "type": "log",
@@ -57,19 +302,30 @@ class WebSocketServer:
                 "type": "log",
                 "source": "local"
             })
+            await self.send_download_state(id, "started")
+
+            loop = asyncio.get_running_loop()
 
             try:
-                song = await Song.download(id)
+                song = await Song.download(
+                    id,
+                    on_stage=lambda stage: self.job_executor.submit(self.job_store.set_stage, id, stage),
+                    on_progress=lambda stage, progress: self.send_download_progress(id, stage, progress)
+                )
+                await loop.run_in_executor(self.job_executor, self.job_store.finish, id)
 
                 await self.send_to_clients({
                     "msg": f"[Downloader {i}] Successfully downloaded {song}",
                     "type": "log",
                     "source": song.source
                 })
+                await self.send_download_state(id, "finished", song)
             except Exception as e:
                 logging.exception("Download failed")
+                await loop.run_in_executor(self.job_executor, self.job_store.fail, id, str(e))
                 await self.send_to_clients({
                     "msg": f"[Downloader {i}] Download for {id} failed: {e}",
                     "type": "error",
                     "source": "local"
                 })
+                await self.send_download_state(id, "failed")